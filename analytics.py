@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+'''
+statistics across all MyTurn meetings, for facilitators
+
+the files of clicks under statistics/, and the archive of finished groups,
+are converted once into columns of numbers, and everything is worked out
+from those columns, a whole column at a time:
+
+    python3 analytics.py [statistics]
+
+only files not seen before are read on each run. the columns are kept
+under statistics/.columns/, in chunks of up to CHUNK rows each.
+'''
+# pragma pylint: disable=multiple-imports
+import sys, os, json, logging
+import numpy
+import clickfiles
+logging.basicConfig(
+    level=logging.DEBUG if __debug__ else logging.INFO,
+    format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+CHUNK = 1 << 20  # rows in one file of columns
+# one row for each request to speak, in every meeting
+REQUESTS = ('meeting', 'user', 'requested', 'granted', 'cancelled')
+# one row for each participant, in every meeting, with time spoken
+SPOKE = ('meeting', 'user', 'spoke')
+
+def ingest(directory='statistics'):
+    '''
+    add any new meetings in `directory` to the columns
+
+    a meeting is known by its group and the start of its talksession, the
+    name of its file of clicks. the archive is read from where the last
+    run left off; it only ever gets appended to.
+    '''
+    columns = os.path.join(directory, '.columns')
+    os.makedirs(columns, exist_ok=True)
+    manifest = load_manifest(columns)
+    ids = {key: {name: index for index, name in enumerate(manifest[key])}
+           for key in ('users', 'meetings')}
+    def intern(key, name):
+        if name not in ids[key]:
+            ids[key][name] = len(manifest[key])
+            manifest[key].append(name)
+        return ids[key][name]
+    requests = Chunks(columns, 'requests', REQUESTS, manifest)
+    for path, record in clickfiles.clicks(directory, manifest['files']):
+        meeting = meetingname(*clickfiles.meeting(path))
+        requests.append((intern('meetings', meeting),
+                         intern('users', record['user']),
+                         record['requested'],
+                         numpy.nan if record.get('granted') is None
+                         else record['granted'],
+                         numpy.nan if record['cancelled'] is None
+                         else record['cancelled']))
+        manifest['files'][path] = True
+    requests.flush()
+    spoke = Chunks(columns, 'spoke', SPOKE, manifest)
+    archive = os.path.join(directory, '.state', 'archive.jsonl')
+    if os.path.exists(archive):
+        with open(archive, 'rb') as infile:
+            infile.seek(manifest['archive'])
+            for line in infile:
+                if not line.endswith(b'\n'):
+                    break  # still being written, leave it for next time
+                manifest['archive'] += len(line)
+                groupdata = json.loads(line.decode('utf8'))
+                meeting = intern('meetings', meetingname(
+                    groupdata['groupname'],
+                    groupdata['talksession']['start']))
+                for user, userdata in groupdata['participants'].items():
+                    spoke.append((meeting, intern('users', user),
+                                  userdata.get('spoke', 0)))
+    spoke.flush()
+    save_manifest(columns, manifest)
+
+def meetingname(group, start):
+    '''
+    name for a meeting, the same whichever file it's found in
+
+    >>> meetingname('test', 1514764800.25)
+    'test/1514764800.250000'
+    '''
+    return '%s/%.6f' % (group, start)
+
+class Chunks():
+    '''
+    rows collected into columns, and saved CHUNK rows at a time
+    '''
+    def __init__(self, directory, table, names, manifest):
+        self.directory, self.table, self.names = directory, table, names
+        self.manifest = manifest
+        self.rows = []
+
+    def append(self, row):
+        '''
+        add a row, saving the chunk if it's full
+        '''
+        self.rows.append(row)
+        if len(self.rows) >= CHUNK:
+            self.flush()
+
+    def flush(self):
+        '''
+        save collected rows as a new chunk, one array per column
+        '''
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        arrays = {name: numpy.array(column, dtype=numpy.int32
+                                    if name in ('meeting', 'user')
+                                    else numpy.float64)
+                  for name, column in zip(self.names, columns)}
+        chunks = self.manifest['chunks'].setdefault(self.table, [])
+        filename = '%s-%d.npz' % (self.table, len(chunks))
+        numpy.savez(os.path.join(self.directory, filename), **arrays)
+        chunks.append(filename)
+        self.rows = []
+
+def load_manifest(columns):
+    '''
+    what has been ingested so far, and the names behind the numbers
+    '''
+    try:
+        with open(os.path.join(columns, 'manifest.json')) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return {'files': {}, 'archive': 0, 'users': [], 'meetings': [],
+                'chunks': {}}
+
+def save_manifest(columns, manifest):
+    '''
+    save the manifest, last, so an interrupted run is simply done again
+    '''
+    path = os.path.join(columns, 'manifest.json')
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(manifest, outfile)
+    os.replace(path + '.tmp', path)
+
+def load(directory, table, names):
+    '''
+    all chunks of a table, as one array per column
+    '''
+    columns = os.path.join(directory, '.columns')
+    chunks = [numpy.load(os.path.join(columns, filename))
+              for filename in load_manifest(columns)['chunks'].get(table, [])]
+    return {name: numpy.concatenate([chunk[name] for chunk in chunks])
+            if chunks else numpy.array([]) for name in names}
+
+def analyze(directory='statistics'):
+    '''
+    speaking shares, time from request to turn, cancellations, and how
+    evenly talk time is spread in meetings, by Gini coefficient
+    '''
+    requests = load(directory, 'requests', REQUESTS)
+    spoke = load(directory, 'spoke', SPOKE)
+    granted = ~numpy.isnan(requests['granted'])
+    cancelled = ~numpy.isnan(requests['cancelled'])
+    latency = requests['granted'][granted] - requests['requested'][granted]
+    meeting = spoke['meeting'].astype(numpy.int64)
+    totals = numpy.bincount(meeting, weights=spoke['spoke'])
+    spoken = totals[meeting] > 0
+    shares = spoke['spoke'][spoken] / totals[meeting][spoken]
+    ginis = gini(meeting, spoke['spoke'])
+    return {
+        'meetings': int(numpy.count_nonzero(totals > 0)),
+        'requests': int(len(requests['requested'])),
+        'granted': int(numpy.count_nonzero(granted)),
+        'cancelled before turn': int(numpy.count_nonzero(
+            cancelled & ~granted)),
+        'seconds to turn': percentiles(latency),
+        'share of talk time': percentiles(shares),
+        'gini of talk time': percentiles(ginis[~numpy.isnan(ginis)]),
+    }
+
+def gini(groups, values):
+    '''
+    Gini coefficient of `values` within each group, all groups at once
+
+    groups without any values, or whose values add up to 0, get nan.
+
+    >>> gini(numpy.array([0, 0, 1, 1, 1]), numpy.array([1., 1, 0, 0, 3]))
+    array([0.        , 0.66666667])
+    '''
+    order = numpy.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    counts = numpy.bincount(groups)
+    starts = numpy.cumsum(counts) - counts
+    ranks = numpy.arange(len(values)) - starts[groups] + 1
+    totals = numpy.bincount(groups, weights=values)
+    weighted = numpy.bincount(groups, weights=ranks * values)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = 2 * weighted / (counts * totals) - (counts + 1) / counts
+    result[totals == 0] = numpy.nan
+    return result
+
+def percentiles(values):
+    '''
+    summary of a distribution
+
+    >>> percentiles(numpy.arange(101.))
+    {'count': 101, 'mean': 50.0, 'median': 50.0, 'p90': 90.0, 'max': 100.0}
+    '''
+    if not len(values):  # pylint: disable=len-as-condition
+        return {'count': 0}
+    low, middle, high = numpy.percentile(values, [50, 90, 100])
+    return {'count': int(len(values)), 'mean': float(numpy.mean(values)),
+            'median': float(low), 'p90': float(middle), 'max': float(high)}
+
+if __name__ == '__main__':
+    DIRECTORY = (sys.argv[1:] or ['statistics'])[0]
+    ingest(DIRECTORY)
+    print(json.dumps(analyze(DIRECTORY), indent=4))
@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+'''
+load test of MyTurn, without a browser, nginx, or uwsgi
+
+many simulated participants in many groups join, poll the talksession
+every half second like client.js does, and now and then press and later
+release "My Turn". the requests go straight to `myturn.server` in this
+process, or with --address to a running `myturn.py serve host:port`.
+
+    python3 benchmark.py [--groups 20] [--participants 10] [--duration 10]
+
+the results are written as JSON to --output, for comparing between runs.
+the server runs in a temporary directory, so its journal and statistics
+don't mix with real ones.
+'''
+# pragma pylint: disable=multiple-imports
+import sys, os, json, time, random, threading, heapq, tempfile, shutil
+import logging, argparse, tracemalloc, urllib.parse, http.client, uuid
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s:%(levelname)s:%(threadName)s:%(message)s')
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+POLL = .5  # seconds between polls, as in client.js
+PRESS = .1  # chance, at each poll, that someone not waiting asks to speak
+HOLD = (1, 5)  # range of seconds a request is held before being cancelled
+
+class InProcess():
+    '''
+    calls `myturn.server` directly, the way uwsgi would
+    '''
+    def __init__(self, myturn):
+        self.myturn = myturn
+
+    def request(self, method, target, form=None):
+        '''
+        return status code and body of a request
+        '''
+        body = urllib.parse.urlencode(form).encode() if form else b''
+        headers = [('Content-Type', 'application/x-www-form-urlencoded')]
+        env = self.myturn.wsgi_environ(method, target, headers, body)
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+        page = b''.join(self.myturn.server(env, start_response))
+        return int(response['status'][:3]), page
+
+class OverSocket():
+    '''
+    sends requests to a running server, a keep-alive connection per thread
+    '''
+    def __init__(self, address):
+        self.host, self.port = address.rsplit(':', 1)
+        self.local = threading.local()
+
+    def request(self, method, target, form=None):
+        '''
+        return status code and body of a request
+        '''
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(
+                self.host, int(self.port))
+        body = urllib.parse.urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        try:
+            self.local.connection.request(method, target, body, headers)
+            response = self.local.connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            del self.local.connection  # reconnect next time
+            raise
+        return response.status, response.read()
+
+def setup(client, groups, participants, minutes):
+    '''
+    create the groups and join everyone to them
+
+    returns the participants, each a dict of what a browser would hold.
+    '''
+    people = []
+    for index in range(groups):
+        group = 'bench%d' % index
+        client.request('POST', '/app', {
+            'submit': 'Submit', 'groupname': group,
+            'total': str(minutes), 'turn': '1'})
+        for number in range(participants):
+            username = 'user%d' % number
+            status, page = client.request('POST', '/app', {
+                'submit': 'Join', 'group': group, 'username': username})
+            if status != 200 or b'talksession-body' not in page:
+                raise RuntimeError('%s could not join %s' % (username, group))
+            people.append({'group': group, 'username': username,
+                           'session': uuid.uuid4().hex, 'version': '',
+                           'release': None})
+    return people
+
+def run(client, people, duration, threads, poll=POLL):
+    '''
+    replay the talksession page for everyone, for `duration` seconds
+
+    returns (kind, seconds) for every request made, and the errors.
+    '''
+    timings, errors = [], []
+    start = time.monotonic()
+    schedule = [(start + random.random() * poll, index)
+                for index in range(len(people))]
+    heapq.heapify(schedule)
+    condition = threading.Condition()
+    def worker():
+        while True:
+            with condition:
+                due, index = heapq.heappop(schedule)
+            if due > start + duration:
+                return
+            time.sleep(max(0, due - time.monotonic()))
+            kind, seconds = step(client, people[index], errors)
+            timings.append((kind, seconds))
+            with condition:
+                heapq.heappush(schedule, (due + poll, index))
+    # no more threads than people, or the extra ones would find none to run
+    pool = [threading.Thread(target=worker, name='worker%d' % number)
+            for number in range(min(threads, len(people)))]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return timings, errors
+
+def step(client, person, errors):
+    '''
+    what one participant's browser does at one poll
+
+    returns the kind of request made and how long it took.
+    '''
+    now = time.monotonic()
+    form = {'groupname': person['group'], 'username': person['username'],
+            'httpsession_key': person['session']}
+    if person['release'] is not None and now >= person['release']:
+        kind, method, target = 'cancel', 'POST', '/talksession/%s'
+        form['submit'] = 'Cancel request'
+        person['release'] = None
+    elif person['release'] is None and random.random() < PRESS:
+        kind, method, target = 'myturn', 'POST', '/talksession/%s'
+        form['submit'] = 'My Turn'
+        person['release'] = now + random.uniform(*HOLD)
+    else:
+        kind, method, form = 'poll', 'GET', None
+        target = '/talksession/%s?since=' + urllib.parse.quote(
+            person['version'])
+    start = time.perf_counter()
+    try:
+        status, page = client.request(method, target % person['group'], form)
+    except (OSError, http.client.HTTPException) as failure:
+        errors.append(repr(failure))
+        return kind, time.perf_counter() - start
+    seconds = time.perf_counter() - start
+    if status != 200:
+        errors.append('%s %s: %d' % (method, target, status))
+    elif page != b'{}':
+        person['version'] = json.loads(page.decode()).get(
+            'version', person['version'])
+    return kind, seconds
+
+def locktimes(myturn):
+    '''
+    copy of the server's histograms of lock waits and holds, see /metrics
+    '''
+    return {key: list(counts) for key, counts in myturn.HISTOGRAMS.items()
+            if key[0] in ('lock_wait_seconds', 'lock_held_seconds')}
+
+def percentile(values, fraction):
+    '''
+    value below which `fraction` of sorted `values` fall
+
+    >>> percentile([1, 2, 3, 4], .5), percentile([1, 2, 3, 4], .99)
+    (3, 4)
+    >>> percentile([], .5)
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def summary(seconds, duration):
+    '''
+    count, rate, and latencies, in milliseconds, of requests
+    '''
+    seconds = sorted(seconds)
+    return {
+        'requests': len(seconds),
+        'requests_per_second': len(seconds) / duration,
+        'p50_ms': (percentile(seconds, .5) or 0) * 1000,
+        'p99_ms': (percentile(seconds, .99) or 0) * 1000,
+        'max_ms': (seconds[-1] if seconds else 0) * 1000,
+    }
+
+def benchmark(options):
+    '''
+    set up, run, and report on one load test
+    '''
+    results = {'options': vars(options), 'time': time.time()}
+    workdir = tempfile.mkdtemp(prefix='myturn-benchmark-')
+    if options.address:
+        client = OverSocket(options.address)
+        memory = myturn = None
+    else:
+        os.symlink(os.path.join(THISDIR, 'html'),
+                   os.path.join(workdir, 'html'))
+        os.chdir(workdir)
+        sys.path.insert(0, THISDIR)
+        import myturn  # pylint: disable=import-outside-toplevel
+        logging.getLogger().setLevel(logging.WARNING)
+        client = InProcess(myturn)
+        tracemalloc.start()
+        memory = tracemalloc.get_traced_memory()[0]
+    try:
+        people = setup(client, options.groups, options.participants,
+                       options.minutes)
+        if memory is not None:
+            memory = tracemalloc.get_traced_memory()[0] - memory
+            tracemalloc.stop()
+            results['bytes_per_participant'] = memory / len(people)
+        before = locktimes(myturn) if myturn else {}  # only count under load
+        timings, errors = run(client, people, options.duration,
+                              options.threads, options.poll)
+    finally:
+        if myturn is not None:
+            myturn.stop()  # its files go in workdir, not in THISDIR
+        os.chdir(THISDIR)
+        if not options.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results['overall'] = summary([seconds for kind, seconds in timings],
+                                 options.duration)
+    for kind in ('poll', 'myturn', 'cancel'):
+        results[kind] = summary([seconds for done, seconds in timings
+                                 if done == kind], options.duration)
+    if myturn is not None and myturn.METRICS:
+        results['locks_ms'] = {}
+        for (name, lock), counts in sorted(locktimes(myturn).items()):
+            earlier = before.get((name, lock), [0] * len(counts))
+            acquires = sum(counts[:-1]) - sum(earlier[:-1])
+            results['locks_ms']['%s %s' % (lock, name.split('_')[1])] = {
+                'acquires': acquires,
+                'total': (counts[-1] - earlier[-1]) * 1000,
+            }
+    results['errors'] = {'count': len(errors), 'first': errors[:5]}
+    return results
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    PARSER.add_argument('--groups', type=int, default=20)
+    PARSER.add_argument('--participants', type=int, default=10,
+                        help='in each group')
+    PARSER.add_argument('--duration', type=float, default=10,
+                        help='seconds of polling and button presses')
+    PARSER.add_argument('--threads', type=int, default=4,
+                        help='like the uwsgi cores, 4 in pyturn.uwsgi')
+    PARSER.add_argument('--poll', type=float, default=POLL,
+                        help='seconds between polls; lower it to find limits')
+    PARSER.add_argument('--minutes', type=float, default=60,
+                        help='length of each meeting')
+    PARSER.add_argument('--address', help='host:port of `myturn.py serve`')
+    PARSER.add_argument('--output', default='benchmark.json')
+    PARSER.add_argument('--keep', action='store_true',
+                        help='leave the temporary directory for inspection')
+    OPTIONS = PARSER.parse_args()
+    OPTIONS.output = os.path.abspath(OPTIONS.output)  # before any chdir
+    RESULTS = benchmark(OPTIONS)
+    with open(OPTIONS.output, 'w') as OUTFILE:
+        json.dump(RESULTS, OUTFILE, indent=4)
+    print(json.dumps(RESULTS, indent=4))
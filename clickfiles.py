@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+'''
+reader for the files of clicks MyTurn saves under statistics/
+
+each is statistics/<group>/<start>.jsonl, with a line for each request to
+speak, or an old, indented <start>.json. shared by `myturn.py statistics`
+and analytics.py, so neither has its own idea of the format; importing it
+has no side effects.
+'''
+# pragma pylint: disable=multiple-imports
+import os, json
+
+def clicks(directory='statistics', seen=()):
+    '''
+    every request to speak in every finished talksession in `directory`
+
+    yields (file, record) one request at a time, so any number of files
+    can be gone through without ever holding more than one line of one
+    file in memory. files in `seen` are skipped, as are those still being
+    written, *.part, and directories that aren't groups, such as .state.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(directory, 'test'))
+    >>> path = os.path.join(directory, 'test', '10.000000.json')
+    >>> with open(path, 'w') as outfile:
+    ...     json.dump([{'jc': [[11, 12]]}], outfile)
+    >>> for path, record in clicks(directory):
+    ...     print(meeting(path), record['user'], record['granted'])
+    ('test', 10.0) jc None
+    >>> import shutil; shutil.rmtree(directory)
+    '''
+    for group in sorted(os.listdir(directory)):
+        groupdir = os.path.join(directory, group)
+        if not os.path.isdir(groupdir) or group.startswith('.'):
+            continue  # not a group: no group's name starts with a dot
+        for filename in sorted(os.listdir(groupdir)):
+            path = os.path.join(groupdir, filename)
+            if path in seen:
+                continue
+            if filename.endswith('.jsonl'):
+                with open(path) as infile:
+                    for line in infile:
+                        yield path, json.loads(line)
+            elif filename.endswith('.json'):
+                with open(path) as infile:
+                    for participant in json.load(infile):  # old format
+                        for username, requests in participant.items():
+                            for requested, cancelled in requests:
+                                yield path, {'user': username,
+                                             'requested': requested,
+                                             'granted': None,
+                                             'cancelled': cancelled}
+
+def meeting(path):
+    '''
+    group and start of the talksession a file of clicks is for
+
+    >>> meeting(os.path.join('statistics', 'test', '1514764800.250000.jsonl'))
+    ('test', 1514764800.25)
+    '''
+    directory, filename = os.path.split(path)
+    return os.path.basename(directory), float(os.path.splitext(filename)[0])
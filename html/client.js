@@ -8,9 +8,13 @@ com.jcomeau.myturn.pages = {};
 com.jcomeau.myturn.page = null;
 com.jcomeau.myturn.pagename = null;
 com.jcomeau.myturn.poller = null;
+com.jcomeau.myturn.events = null;  // EventSource, if browser supports it
+com.jcomeau.myturn.lastEvent = 0;  // time last event arrived
 com.jcomeau.myturn.username = null;
 com.jcomeau.myturn.groupname = null;
-com.jcomeau.myturn.groupdata = {talksession: {}, participants: {}};
+// what /talksession/ sent last, with any later changes merged in
+com.jcomeau.myturn.talksession = {waiting: []};
+com.jcomeau.myturn.requesting = false;  // own "My Turn" request pending
 // no need to use `window.` anything; it is implied
 com.jcomeau.myturn.icon = "url('images/myturn-logo.png')";
 com.jcomeau.myturn.debugging = [];
@@ -68,7 +72,7 @@ com.jcomeau.myturn.myTurn = function(event) {
     var newColor = cjm.rgb(cjm.toggle(cjm.buttonBackground));
     console.debug("changing 'My Turn' background color to " + newColor);
     event.target.style.backgroundColor = newColor;
-    request.open("POST", "/groups/" + cjm.groupname);
+    request.open("POST", "/talksession/" + cjm.groupname);
     request.responseType = "json";  // returns object
     request.onreadystatechange = function() {
         console.debug("response code " + request.readyState + ": " +
@@ -123,7 +127,7 @@ com.jcomeau.myturn.cancelRequest = function(event) {
     console.debug("restoring 'My Turn' background color to " + newColor);
     event.target.style.backgroundColor = newColor;
     console.debug("My Turn mouseup");
-    request.open("POST", "/groups/" + cjm.groupname);
+    request.open("POST", "/talksession/" + cjm.groupname);
     request.responseType = "json";  // returns object
     request.onreadystatechange = function() {
         console.debug("response code " + request.readyState + ": " +
@@ -184,73 +188,181 @@ com.jcomeau.myturn.switchPage = function(response, otherpage) {
 com.jcomeau.myturn.updateTalkSession = function() {
     var cjm = com.jcomeau.myturn;
     var request = new XMLHttpRequest();  // not supporting IE
-    request.open("GET", "/groups/" + cjm.groupname);
+    // server sends only the clock if nothing else changed since `version`
+    request.open("GET", "/talksession/" + cjm.groupname + "?since=" +
+                 encodeURIComponent(cjm.talksession.version || ""));
     request.responseType = "json";  // returns object
     request.onreadystatechange = function() {
         console.debug("response code " + request.readyState + ": " +
                     JSON.stringify(request.response || {}));
         if (request.readyState == XMLHttpRequest.DONE &&
                 request.status == 200) {
-            var groupdata = cjm.phantom.parse(request.response);
-            if (groupdata.groupname !== cjm.groupname) {
-                cjm.phantom.log("groupdata: " + groupdata);
-                console.debug("groupname now " + groupdata.groupname +
-                            ", was: " + cjm.groupname);
-                cjm.poller = clearInterval(cjm.poller);
-                console.debug("discussion over, redirecting to report page");
-                return cjm.showReport();
-            }
-            var speaker = groupdata.talksession.speaker;
-            var remaining = groupdata.talksession.remaining;
-            var tick = groupdata.talksession.tick;
-            var speakerStatus = document.getElementById("talksession-speaker");
-            var beatHeart = false;
-            speakerStatus.textContent = speaker ?
-                "Current speaker is " + speaker:
-                "Waiting for next speaker";
-            var timeStatus = document.getElementById("talksession-time");
-            // only update time at start of new quantum
-            if (speaker) {
-                var previousData = cjm.groupdata;
-                console.debug("previous data: " + JSON.stringify(previousData));
-                console.debug("participants: " + previousData.participants);
-                var previousTime = 1000000;  // arbitrarily high number
-                var previousSpeaker = previousData.talksession.speaker;
-                if (previousSpeaker == speaker &&
-                        previousData.participants[speaker]) {
-                    console.debug("same speaker, checking if new quantum");
-                    previousTime = previousData.participants[speaker].speaking;
-                }
-                var currentTime = groupdata.participants[speaker].speaking;
-                console.debug("will update time field if " + currentTime +
-                            " < " + previousTime);
-                if (currentTime < previousTime)
-                    timeStatus.textContent = new Date(
-                        null, 0, 1, 0, 0, remaining).toString().split(" ")[4];
-            }
-            // heartbeat affected by dropped/delayed packets on purpose
-            // it helps participants gauge network speed
-            cjm.pollcount += 1;  // update count
-            // active speaker, vibrate every query (every half second)
-            if (speaker === cjm.username) beatHeart = true;
-            // waiting to speak, vibrate every second
-            else if (groupdata.participants[cjm.username].request)
-                beatHeart = (cjm.pollcount - cjm.lastPulse >= 2) ? true : false;
-            // otherwise beat every 2 seconds
-            else if (cjm.pollcount - cjm.lastPulse >= 4) beatHeart = true;
-            // save actual call to navigator.vibrate() to very end
-            // otherwise groupdata and pollcount won't get updated
-            cjm.groupdata = groupdata;
-            if (beatHeart) {
-                cjm.lastPulse = cjm.pollcount;
-                console.debug("beating heart with vibrate or flash");
-                navigator.vibrate ? navigator.vibrate(cjm.beat) : cjm.flash();
+            var changes = cjm.phantom.parse(request.response);
+            if (cjm.showTalkSession(cjm.merge(cjm.talksession, changes)))
+                cjm.heartbeat();
+        }
+    };
+    request.send();
+};
+
+com.jcomeau.myturn.pollTalkSession = function() {
+    // the binary heartbeat once there is JSON to fill in names from
+    var cjm = com.jcomeau.myturn;
+    if (cjm.talksession.version && typeof DataView != "undefined")
+        cjm.pollHeartbeat();
+    else cjm.updateTalkSession();
+};
+
+com.jcomeau.myturn.pollHeartbeat = function() {
+    // 24 bytes, laid out as HEARTBEAT in myturn.py, big-endian
+    var cjm = com.jcomeau.myturn;
+    var request = new XMLHttpRequest();  // not supporting IE
+    request.open("GET", "/heartbeat/" + cjm.groupname + "?username=" +
+                 encodeURIComponent(cjm.username) + "&since=" +
+                 cjm.talksession.tick);
+    request.responseType = "arraybuffer";
+    request.onreadystatechange = function() {
+        if (request.readyState == XMLHttpRequest.DONE &&
+                request.status == 200) {
+            var view = new DataView(request.response);
+            var flags = view.getUint8(1);
+            if (flags & 4) return cjm.showTalkSession({});  // ENDED
+            // version is tick-change-instance; only the tick is new here
+            var version = cjm.talksession.version.split("-");
+            var instance = ("0000000" + view.getUint32(8).toString(16))
+                .slice(-8);
+            if (String(view.getUint32(4)) != version[1] ||
+                    instance != version[2]) {
+                console.debug("group or server changed, fetching JSON");
+                return cjm.updateTalkSession();
             }
+            var index = view.getInt16(2);
+            var tick = view.getUint32(12);
+            var changes = {
+                version: [tick].concat(version.slice(1)).join("-"),
+                tick: tick,
+                remaining: view.getFloat32(16),
+                speaking: view.getFloat32(20),
+                speaker: index < 0 ? null : cjm.talksession.participants[index]
+            };
+            if (cjm.showTalkSession(cjm.merge(cjm.talksession, changes),
+                                    (flags & 1) != 0, (flags & 2) != 0))
+                cjm.heartbeat();
         }
     };
     request.send();
 };
 
+com.jcomeau.myturn.merge = function(talksession, changes) {
+    // new object with `changes` applied; empty if the group is gone
+    if (!changes.version) return {};
+    var merged = {};
+    for (var key in talksession) merged[key] = talksession[key];
+    for (key in changes) merged[key] = changes[key];
+    return merged;
+};
+
+com.jcomeau.myturn.listen = function() {
+    // have the server push changes instead of polling for them
+    var cjm = com.jcomeau.myturn;
+    var events = new EventSource("/events/" + cjm.groupname);
+    cjm.events = events;
+    events.addEventListener("group", function(event) {
+        cjm.lastEvent = Date.now();
+        cjm.showTalkSession(cjm.merge({}, JSON.parse(event.data)));
+    });
+    events.addEventListener("remaining", function(event) {
+        cjm.lastEvent = Date.now();  // nothing changed, but still connected
+    });
+    events.addEventListener("finished", function(event) {
+        cjm.showTalkSession({});  // closes stream, redirects to report
+    });
+    events.onerror = function(event) {
+        // browser reconnects by itself unless the server refused the stream
+        if (events.readyState == EventSource.CLOSED && cjm.events) {
+            console.debug("event stream refused, polling instead");
+            cjm.events = null;
+            cjm.poller = clearInterval(cjm.poller);
+            cjm.poller = setInterval(cjm.pollTalkSession, 500);
+        }
+    };
+    // heartbeat only while events are arriving, like it would when polling
+    cjm.poller = setInterval(function() {
+        if (Date.now() - cjm.lastEvent < 2000) cjm.heartbeat();
+    }, 500);
+};
+
+com.jcomeau.myturn.showTalkSession = function(talksession, quantum,
+                                               requesting) {
+    // returns false if talksession is over
+    // `quantum` and `requesting` come from the heartbeat, not from JSON
+    var cjm = com.jcomeau.myturn;
+    if (talksession.groupname !== cjm.groupname) {
+        cjm.phantom.log("talksession: " + talksession);
+        console.debug("groupname now " + talksession.groupname +
+                    ", was: " + cjm.groupname);
+        cjm.poller = clearInterval(cjm.poller);
+        if (cjm.events) cjm.events.close();
+        cjm.events = null;
+        console.debug("discussion over, redirecting to report page");
+        cjm.showReport();
+        return false;
+    }
+    var speaker = talksession.speaker;
+    var remaining = talksession.remaining;
+    var tick = talksession.tick;
+    var speakerStatus = document.getElementById("talksession-speaker");
+    speakerStatus.textContent = speaker ?
+        "Current speaker is " + speaker:
+        "Waiting for next speaker";
+    var timeStatus = document.getElementById("talksession-time");
+    // only update time at start of new quantum
+    if (speaker) {
+        var previousData = cjm.talksession;
+        console.debug("previous data: " + JSON.stringify(previousData));
+        var previousTime = 1000000;  // arbitrarily high number
+        var previousSpeaker = previousData.speaker;
+        if (previousSpeaker == speaker) {
+            console.debug("same speaker, checking if new quantum");
+            previousTime = previousData.speaking;
+        }
+        var currentTime = talksession.speaking;
+        console.debug("will update time field if " + currentTime +
+                    " < " + previousTime);
+        if (quantum || currentTime < previousTime)
+            timeStatus.textContent = new Date(
+                null, 0, 1, 0, 0, remaining).toString().split(" ")[4];
+    }
+    cjm.requesting = requesting === undefined ?
+        talksession.waiting.indexOf(cjm.username) >= 0 : requesting;
+    cjm.talksession = talksession;
+    return true;
+};
+
+com.jcomeau.myturn.heartbeat = function() {
+    // heartbeat affected by dropped/delayed packets on purpose
+    // it helps participants gauge network speed
+    var cjm = com.jcomeau.myturn;
+    var talksession = cjm.talksession;
+    var speaker = talksession.speaker;
+    var beatHeart = false;
+    cjm.pollcount += 1;  // update count
+    // active speaker, vibrate every query (every half second)
+    if (speaker === cjm.username) beatHeart = true;
+    // waiting to speak, vibrate every second
+    else if (cjm.requesting)
+        beatHeart = (cjm.pollcount - cjm.lastPulse >= 2) ? true : false;
+    // otherwise beat every 2 seconds
+    else if (cjm.pollcount - cjm.lastPulse >= 4) beatHeart = true;
+    // save actual call to navigator.vibrate() to very end
+    // otherwise pollcount won't get updated
+    if (beatHeart) {
+        cjm.lastPulse = cjm.pollcount;
+        console.debug("beating heart with vibrate or flash");
+        navigator.vibrate ? navigator.vibrate(cjm.beat) : cjm.flash();
+    }
+};
+
 com.jcomeau.myturn.showReport = function() {
     var cjm = com.jcomeau.myturn;
     var request = new XMLHttpRequest();  // not supporting IE
@@ -343,7 +455,8 @@ com.jcomeau.myturn.pageSpecificSetup = function() {
         };
         var checkStatus = document.getElementById("check-status");
         checkStatus.parentNode.removeChild(checkStatus);
-        cjm.poller = setInterval(cjm.updateTalkSession, 500);
+        if (typeof EventSource != "undefined") cjm.listen();
+        else cjm.poller = setInterval(cjm.pollTalkSession, 500);
         cjm.initializeVibration();
     }
 };
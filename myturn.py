@@ -21,24 +21,30 @@ or
 # disable warnings about uwsgi, which isn't available outside uwsgi context
 # pragma pylint: disable=wrong-import-position, invalid-name
 import sys, os, urllib.request, urllib.error, urllib.parse, logging, pwd
-import subprocess, site, cgi, datetime, threading, copy, json
-import uuid, time, re
+import subprocess, site, datetime, threading, copy, json, contextvars
+import signal, hmac, struct, contextlib
+import uuid, time, re, heapq, itertools, asyncio, io, zlib, bisect
 from html import escape  # ***MUST COME before `from lxml import html`!***
 from collections import defaultdict, OrderedDict
-from lxml import html
+from multiprocessing.managers import BaseManager
+from lxml import html, etree
 from lxml.html import builder
 from http.cookies import SimpleCookie
+from clickfiles import clicks
 logging.basicConfig(
     level=logging.DEBUG if __debug__ else logging.INFO,
     format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# LOCK guards only what all groups share: which groups exist, which are
+# finished, and SNAPSHOT. anything within a group is guarded by its own
+# lock, see `grouplock`, which must always be taken *before* LOCK.
 LOCK = threading.Lock()
+GROUPLOCKS = {}  # group: threading.Lock, until `evict`, see `grouplock`
+SESSIONLOCK = threading.Lock()  # guards HTTPSESSIONS
 try:  # command-line testing won't have module available
     import uwsgi
     #logging.debug('uwsgi: %s', dir(uwsgi))
 except ImportError:
     uwsgi = type('uwsgi', (), {'opt': {}})  # object with empty opt attribute
-    uwsgi.lock = LOCK.acquire
-    uwsgi.unlock = LOCK.release
 #logging.debug('uwsgi.opt: %s', repr(uwsgi.opt))
 #logging.debug('sys.argv: %s', sys.argv)  # only shows [uwsgi]
 # 2017-12-28 set `chdir` option in pyturn.uwsgi so now PWD should be correct
@@ -52,13 +58,97 @@ else:
     logging.warning('THISDIR: %s, os.getcwd(): %s', THISDIR, os.getcwd())
 APPDIR = (uwsgi.opt.get('check_static', b'').decode() or
           os.path.join(THISDIR, 'html'))
+APPROOT = os.path.realpath(APPDIR)  # what `static` may serve from
 MIMETYPES = {'png': 'image/png', 'ico': 'image/x-icon', 'jpg': 'image/jpeg',
-             'jpeg': 'image/jpeg',}
+             'jpeg': 'image/jpeg', 'html': 'text/html', 'css': 'text/css',
+             'js': 'application/javascript',}
+# not worth gzipping what is already compressed
+COMPRESSIBLE = ('text/', 'application/javascript', 'image/x-icon')
+STATIC = {}  # filename: file as last read, see `static`
 DATA = {
     'groups': {},  # active groups
     'finished': {},  # inactive groups (for "Report" page)
 }
-HTTPSESSIONS = {}  # data like username, linked with session keys, goes here
+# read-only copy of DATA, replaced (never modified) by `publish`
+# `mutations` holds, for each active group, the version it last changed in,
+# and `finishes` the version in which each finished group finished
+SNAPSHOT = {'version': 0, 'groups': {}, 'finished': {}, 'mutations': {},
+            'finishes': {}}
+# where DATA and HTTPSESSIONS are kept, if not in this process: host:port
+# or the path of a unix socket, see `stateserver`
+STATE = (uwsgi.opt.get('state-server', b'').decode() or
+         os.getenv('MYTURN_STATE', ''))
+STATEKEY = (uwsgi.opt.get('state-key', b'') or
+            os.getenv('MYTURN_STATE_KEY', '').encode())
+FRESHNESS = .1  # seconds a process may serve a copy of shared state
+INSTANCE = uuid.uuid4().hex  # tells SharedState when the server restarted
+GROUPCACHE = {}  # group: (cache key, ETag, encoded JSON) for /groups/<group>
+# group: (cache key, version, encoded projection, encoded clock-only delta)
+TALKCACHE = {}  # for /talksession/<group>, see `talksession_json`
+TIMERS = []  # heap of [deadline, sequence, function, args], see `schedule`
+TIMER = threading.Condition()  # guards TIMERS, wakes the scheduler
+SEQUENCE = itertools.count()  # tiebreaker so functions are never compared
+SCHEDULER = []  # the thread running `scheduler`, and the pid it runs in
+QUEUES = {}  # group: heap of (spoke, request, username), see `enqueue`
+LISTENERS = defaultdict(set)  # group: event stream callbacks, see `announce`
+EVENTS = threading.Lock()  # guards LISTENERS
+# serve /events/ streams from a thread of their own if this is set,
+# host:port or the path of a unix socket, see `eventserver`
+EVENTSOCKET = (uwsgi.opt.get('events-socket', b'').decode() or
+               os.getenv('MYTURN_EVENTS', ''))
+REPORTS = {}  # group: (rows, report-body HTML) rendered once by `finish`
+# keep the timings served at /metrics, unless set to "off"; see `observe`
+METRICS = (uwsgi.opt.get('metrics', b'').decode() or
+           os.getenv('MYTURN_METRICS', 'on')) != 'off'
+BUCKETS = (.00001, .00005, .0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+HISTOGRAMS = {}  # (name, label): counts for each of BUCKETS, +Inf, and sum
+# name: (label name, help text) of each histogram, in /metrics order
+HISTOGRAMHELP = OrderedDict([
+    ('request_seconds', ('path', 'time to answer a request')),
+    ('lock_wait_seconds', ('lock', 'time waiting to acquire a lock')),
+    ('lock_held_seconds', ('lock', 'time a lock was held')),
+    ('serialize_seconds', ('step', 'time copying and encoding groups')),
+    ('timer_lateness_seconds', ('function', 'how late timers ran')),
+    ('timer_run_seconds', ('function', 'time timers took to run')),
+])
+ROUTES = ('app', 'noscript', 'groups', 'talksession', 'heartbeat', 'report',
+          'events', 'status', 'metrics', 'profile')  # not files
+# /profile?key=<this>&seconds=<n> samples stacks, see `profile`; no key, no
+# profiling. `kill -USR2` does the same for `myturn.py serve` and `state`
+PROFILEKEY = (uwsgi.opt.get('profile-key', b'').decode() or
+              os.getenv('MYTURN_PROFILE_KEY', ''))
+PROFILES = 'profiles'  # where collapsed-stack files are written
+PROFILING = []  # the one thread running `sample`, while it runs
+PROFILELOCK = threading.Lock()  # guards PROFILING
+SAMPLE = .005  # seconds between stack samples
+# the server's own files, kept apart from the directories of clicks named
+# after groups; `sanitize` strips leading dots, so no group can be named this
+STATEDIR = os.path.join('statistics', '.state')
+# every change to a group, as it was afterwards, goes into JOURNAL, a file
+# per `generation`; CHECKPOINT has all active groups as of the start of
+# its generation. see `journal`, `commit`, and `recover`
+JOURNAL = os.path.join(STATEDIR, 'journal')
+CHECKPOINT = os.path.join(STATEDIR, 'checkpoint.json')
+COMMIT = .2  # seconds a change may wait to be written and synced to disk
+CHECKPOINTS = 1000  # changes in a generation before the next checkpoint
+# `clicks` are (path, line) for `commit` to append to statistics files
+# and `archive` finished (group, groupdata) for it to add to ARCHIVE
+WAL = {'pending': [], 'clicks': [], 'archive': [], 'generation': 0,
+       'records': 0}  # LOCK
+WRITER = []  # the thread running `writer`, and the pid it runs in
+WRITE = threading.Event()  # set by `wake` when a `commit` is due
+COMMITTING = threading.Lock()  # one `commit` at a time, see `stop`
+MAXFINISHED = 100  # finished groups kept in memory, the rest are in ARCHIVE
+# every finished group, one JSON line each, and where each one starts
+ARCHIVE = os.path.join(STATEDIR, 'archive.jsonl')
+ARCHIVEINDEX = None  # group: (offset, length) in ARCHIVE, see `archive_index`
+ARCHIVELOCK = threading.Lock()  # guards ARCHIVE and ARCHIVEINDEX
+# data like username, linked with session keys, goes here,
+# least recently updated first, see `expire_httpsessions`
+HTTPSESSIONS = OrderedDict()
+SESSIONTTL = 12 * 60 * 60  # seconds a session lasts without being updated
+MAXSESSIONS = 10000  # least recently updated sessions beyond this are dropped
+SESSIONCOUNTS = {'expired': 0, 'evicted': 0}  # sessions dropped, and why
 EXPECTED_ERRORS = (
     NotImplementedError,
     ValueError,
@@ -66,43 +156,101 @@ EXPECTED_ERRORS = (
     IndexError,
     SystemError,
 )
-PARSED = html.parse(os.path.join(APPDIR, 'index.html')).getroot()
-PAGE = html.tostring(PARSED.getroottree())
-DEBUG = ['all']  # populate from querystring
+PAGE = html.tostring(html.parse(os.path.join(APPDIR, 'index.html')))
+TEMPLATES = {}  # index.html as %-format strings, see `compile_templates`
+SLOTS = {}  # default values for the slots in TEMPLATES
+PAGEIDS = []  # `id`s of div.body elements, the "pages" of the app
+FIELDS = ['username', 'groupname', 'httpsession_key', 'joined']  # from POST
+MARK = '@@%s@@'  # placeholder for a slot while compiling TEMPLATES
+SLOT = re.compile(r' data-slot="@@(\w+)@@"|"@@(\w+)@@"|@@(\w+)@@')
+BOUNDARY = re.compile(r'boundary="?([^";]+)"?')
+PARTNAME = re.compile(rb'\bname="([^"]*)"')
+COOKIEQUOTED = re.compile(r'\\(?:([0-3][0-7][0-7])|(.))')
+# compiled once, rather than building an XPath string for every query
+XPATH = {
+    'pages': etree.XPath('//div[@class="body"]'),
+    'grouplist': etree.XPath('//select[@name="group"]'),
+    'refresh': etree.XPath('//meta[@http-equiv="refresh"]'),
+    'rows': etree.XPath('.//table/tr'),
+    'columns': etree.XPath('./td'),
+    'inputs': etree.XPath('//input[@name=$name]'),
+}
+# debug categories logged on every request, none unless set; more can be
+# had for one request with ?debug=<category>, or for one browser with a
+# `debug` cookie of comma-separated categories. see `findpath`
+DEBUG = set((uwsgi.opt.get('debug-categories', b'').decode() or
+             os.getenv('MYTURN_DEBUG', 'none')).replace(',', ' ').split())
+DEBUG.discard('none')
+REQUESTDEBUG = contextvars.ContextVar('REQUESTDEBUG', default=frozenset())
 # create translation table of illegal characters for groupnames
 # ":" is used in this program for internal purposes, so disallow that
 # "/" cannot be allowed because we create a filename from groupname
 # otherwise, mostly being permissive
 ILLEGAL = str.maketrans(dict.fromkeys('''([{:/'"}])'''))
+TICK = .25  # seconds per talksession `tick`, as seen by clients
+# /heartbeat/<group>: layout version, flags, speaker's index in the sorted
+# participants, version the group last changed in, the server's instance as
+# in `version_tag`, tick, remaining, speaking
+HEARTBEAT = struct.Struct('!BBhIIIff')
+QUANTUM, REQUESTING, ENDED = 1, 2, 4  # HEARTBEAT flags, see `heartbeat`
+PING = 1  # seconds between `remaining` events on an otherwise idle stream
+KEEPALIVE = 75  # seconds asyncio server keeps an idle connection open
+MAXBODY = 1 << 20  # largest request body read, by any server
 
 def debug(category, *args):
     '''
     log debug code only for given category
 
-    reduces log size and allows for granular approach to debugging
+    reduces log size and allows for granular approach to debugging. the
+    arguments are only formatted if the message is logged, so pass them
+    separately rather than %-formatting them first. under `python -O`
+    this returns at once.
+
+    >>> token = REQUESTDEBUG.set(frozenset(['doctest']))
+    >>> logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+    >>> debug('doctest', 'only for %s', 'this request')
+    only for this request
+    >>> REQUESTDEBUG.reset(token)
+    >>> debug('doctest', 'only for %s', 'that request')
+    >>> logging.getLogger().handlers.pop() and None
     '''
     if not __debug__:
         return
-    elif category in DEBUG:
+    elif category in DEBUG or category in REQUESTDEBUG.get():
         logging.debug(*args)
 
 def findpath(env):
     '''
     locate directory where files are stored, and requested file
 
-    side effect: splits off querystring and stores its debug values in DEBUG
+    side effect: the debug categories asked for by the querystring, and
+    by any `debug` cookie, are turned on for this request only.
 
-    NOTE: DEBUG is a global and as such will be affected by any client adding
-    `debug=` args to his querystring. so the net result in debugging will be
-    the union of what all the clients request.
+    >>> findpath({'REQUEST_URI': '/app?debug=join&debug=x'})[1]
+    'app'
+    >>> sorted(REQUESTDEBUG.get())
+    ['join', 'x']
+    >>> findpath({'REQUEST_URI': '/', 'HTTP_COOKIE': 'debug=hidden,report'})
+    ... # doctest: +ELLIPSIS
+    (..., '')
+    >>> sorted(REQUESTDEBUG.get())
+    ['hidden', 'report']
+    >>> findpath({'REQUEST_URI': '/'}) and REQUESTDEBUG.get()
+    frozenset()
     '''
     start = APPDIR
     parsed = urllib.parse.urlparse(
         urllib.parse.unquote(env.get('REQUEST_URI', '')))
+    categories = set()
     if parsed.query:
         query = urllib.parse.parse_qs(parsed.query or '')
-        DEBUG[:] = list(set(DEBUG) | set(query.get('debug', [])))
-    debug('all', 'findpath: start: %s' % start)
+        categories.update(query.get('debug', []))
+    if 'debug=' in env.get('HTTP_COOKIE', ''):
+        categories.update(filter(None, parse_cookies(
+            env['HTTP_COOKIE']).get('debug', '').split(',')))
+    # set on every request, so nothing carries over to this thread's next
+    REQUESTDEBUG.set(frozenset(categories))
+    debug('all', 'findpath: start: %s', start)
     path = urllib.parse.unquote(env.get('HTTP_PATH', ''))
     #debug('all', 'path, attempt 1: %s', path)
     path = path or parsed.path
@@ -118,13 +266,17 @@ def loadpage(path, data=None):
     eventually client-side JavaScript will perform many of these functions.
     '''
     data = data or DATA
-    parsed = html.fromstring(PAGE)
     postdict = data.get('postdict', {})
     debug('load', 'loadpage: postdict: %s', postdict)
-    set_values(parsed, postdict,
-               ['username', 'groupname', 'httpsession_key', 'joined'])
+    slots = dict(SLOTS)
+    for fieldname in FIELDS:
+        value = postdict.get(fieldname, '')
+        if value:
+            slots['value_' + fieldname] = escape_attribute(value)
+            slots['valueattr_' + fieldname] = ' value=%s' % (
+                slots['value_' + fieldname])
     if 'groups' in data:
-        groups = populate_grouplist(parsed, data)
+        groups = grouplist_slots(data, slots)
     else:
         groups = []
     debug('load', 'loadpage: groups: %s', groups)
@@ -132,290 +284,881 @@ def loadpage(path, data=None):
     # get rid of meta refresh if path has already been chosen
     if path == '':
         debug('load', 'showing load indicator')
-        hide_except('loading', parsed)
-        return html.tostring(parsed).decode()
-    else:
-        for tag in parsed.xpath('//meta[@http-equiv="refresh"]'):
-            tag.getparent().remove(tag)
+        show('loading', slots)
+        return TEMPLATES['page', 'refresh'] % slots
     if 'text' in postdict:
-        message = builder.PRE(postdict['text'])
-        parsed.xpath('//div[@id="error-text"]')[0].append(message)
+        slots['error'] = '<pre>%s</pre>' % escape_text(postdict['text'])
         debug('load', 'showing error page')
-        hide_except('error', parsed)
+        show('error', slots)
     elif postdict.get('joined'):
         debug('join', 'found "joined": %s', data['postdict'])
         group = sanitize(postdict['groupname'])
         if not group in groups:
-            if not group in data['finished']:
-                debug('all', 'nonexistent group, showing joinform again')
-                hide_except('joinform', parsed)
-            else:
-                create_report(parsed, group, data)
+            try:
+                slots['rows'] = report(group, data)[0]
                 debug('all', 'showing report page')
-                hide_except('report', parsed)
+                show('report', slots)
+            except KeyError:
+                debug('all', 'nonexistent group, showing joinform again')
+                show('joinform', slots)
         else:
-            groupdata = data['groups'][group]
-            speaker = select_speaker(group, data)
+            groupdata = elapsed(data['groups'][group])
+            speaker = groupdata['talksession']['speaker']
             userdata = groupdata['participants'][postdict['username']]
             remaining = groupdata['talksession']['remaining']
-            set_text(parsed, ['talksession-speaker'],
-                     ['Current speaker is %s' % speaker if speaker else
-                      'Waiting for next speaker'])
-            set_text(parsed, ['talksession-time'], [formatseconds(remaining)])
-            debug('talk', 'userdata[request]: %.6f', userdata['request'])
-            buttonvalue = 'Cancel request' if userdata['request'] else 'My Turn'
+            slots['speaker'] = escape_text('Current speaker is %s' % speaker
+                                           if speaker else
+                                           'Waiting for next speaker')
+            slots['time'] = formatseconds(remaining)
+            debug('talk', 'userdata[request]: %.6f',
+                  userdata.get('request') or 0)
+            buttonvalue = ('Cancel request' if userdata.get('request')
+                           else 'My Turn')
             debug('talk', 'setting buttonvalue to %s', buttonvalue)
-            set_button(parsed, ['myturn-button'], [buttonvalue])
+            slots['button'] = escape_attribute(buttonvalue)
             debug('talk', 'showing talk page')
-            hide_except('talksession', parsed)
+            show('talksession', slots)
     elif (postdict.get('submit') == 'Join' and postdict.get('username') and
           postdict.get('group', '') == ''):
         # some browsers won't return `group` in postdict at all if
         # selected element is empty (as it is by default in this case)
         debug('join', 'showing groupform after joinform')
-        hide_except('groupform', parsed)
+        show('groupform', slots)
     else:
         debug('load', 'showing joinform by default')
-        hide_except('joinform', parsed)
-    return html.tostring(parsed).decode()
-
-def create_report(parsed=None, group=None, data=None, **formatting):
-    '''
-    show participants with the amount of time each spoke
-
-    >>> parsed = html.fromstring("""
-    ... <div id="report-body" class="body">
-    ...  <div id="report-wrapper" class="pagewrapper top">
-    ...   <div id="report-box" class="box">
-    ...    <table>
-    ...     <tr><th>Name</th><th>Elapsed Time</th></tr>
-    ...     <tr><td>(none)</td><td>00:00:00</td></tr>
-    ...    </table>
-    ...   </div><!-- box -->
-    ...  </div><!-- pagewrapper -->
-    ... </div><!-- body -->""")
+        show('joinform', slots)
+    return TEMPLATES['page'] % slots
+
+def compile_templates():
+    '''
+    turn index.html into %-format strings, once, at startup
+
+    each place `loadpage` fills in is marked, the page serialized, and
+    the marks replaced by %(name)s slots; attribute slots take the value
+    with its quotes, as from `escape_attribute`. then a page load is
+    nothing but a string format: no parsing, searching, or serializing.
+    the output is the same as modifying the parsed page and serializing
+    it with lxml.
+    '''
+    parsed = html.fromstring(PAGE)
+    for page in XPATH['pages'](parsed):
+        PAGEIDS.append(page.get('id'))
+        page.set('data-slot', MARK % slotname(page.get('id')))
+        SLOTS[slotname(page.get('id'))] = ''
+    for fieldname in FIELDS:
+        for element in XPATH['inputs'](parsed, name=fieldname):
+            if element.get('value') is None:
+                element.set('data-slot', MARK % ('valueattr_' + fieldname))
+            else:
+                SLOTS['value_' + fieldname] = escape_attribute(
+                    element.get('value'))
+                element.set('value', MARK % ('value_' + fieldname))
+        SLOTS['valueattr_' + fieldname] = ''
+        SLOTS.setdefault('value_' + fieldname, '""')
+    for elementid, name in (('talksession-speaker', 'speaker'),
+                            ('talksession-time', 'time'),
+                            ('error-text', 'error')):
+        parsed.get_element_by_id(elementid).text = MARK % name
+        SLOTS[name] = ''
+    button = parsed.get_element_by_id('myturn-button')
+    SLOTS['button'] = escape_attribute(button.get('value'))
+    button.set('value', MARK % 'button')
+    grouplist = XPATH['grouplist'](parsed)[0]
+    SLOTS['contents'] = escape_attribute(grouplist.get('data-contents', ''))
+    grouplist.set('data-contents', MARK % 'contents')
+    SLOTS['options'] = escape_text(grouplist.text or '') + ''.join(
+        html.tostring(option, encoding=str) for option in grouplist)
+    default = grouplist[0]
+    TEMPLATES['options'] = (escape_text(grouplist.text or ''),
+                            escape_text(default.tail or ''))
+    default.attrib.pop('selected', None)
+    TEMPLATES['option', 'default'] = html.tostring(
+        default, encoding=str, with_tail=False)
+    default.set('selected', 'selected')
+    TEMPLATES['option', 'default', 'selected'] = html.tostring(
+        default, encoding=str, with_tail=False)
+    option = builder.OPTION(MARK % 'text', value=MARK % 'value')
+    TEMPLATES['option'] = template(option)
+    option.set('selected', 'selected')
+    TEMPLATES['option', 'selected'] = template(option)
+    for option in list(grouplist):
+        grouplist.remove(option)
+    grouplist.text = MARK % 'options'
+    TEMPLATES['grouplist'] = template(grouplist)
+    header, row = XPATH['rows'](parsed.get_element_by_id('report-body'))[:2]
+    SLOTS['rows'] = html.tostring(row, encoding=str)
+    header.tail = (header.tail or '') + MARK % 'rows'
+    row.getparent().remove(row)
+    columns = XPATH['columns'](row)
+    columns[0].text, columns[1].text = MARK % 'name', MARK % 'time'
+    TEMPLATES['row'] = template(row)
+    TEMPLATES['report'] = template(parsed.get_element_by_id('report-body'))
+    TEMPLATES['page', 'refresh'] = template(parsed)
+    for tag in XPATH['refresh'](parsed):
+        tag.getparent().remove(tag)
+    TEMPLATES['page'] = template(parsed)
+
+def template(element):
+    '''
+    serialize marked-up element as a %-format string
+
+    >>> template(html.fromstring(
+    ...  '<p data-slot="@@style@@">100% @@text@@</p>'))
+    '<p%(style)s>100%% %(text)s</p>'
+    >>> template(html.fromstring('<p title="@@title@@">@@text@@</p>'))
+    '<p title=%(title)s>%(text)s</p>'
+    '''
+    return SLOT.sub(lambda match: '%%(%s)s' % next(filter(None,
+                                                          match.groups())),
+                    html.tostring(element, encoding=str).replace('%', '%%'))
+
+def slotname(pageid):
+    '''
+    name of the slot for a page's `style` attribute
+
+    >>> slotname('joinform-body')
+    'style_joinform_body'
+    '''
+    return 'style_' + pageid.replace('-', '_')
+
+def show(keep, slots):
+    '''
+    set "display: none" for all sections of the page we don't want to see
+    '''
+    for pageid in PAGEIDS:
+        slots[slotname(pageid)] = ('' if pageid.startswith(keep) else
+                                   ' style="display: none"')
+
+def grouplist_slots(data, slots):
+    '''
+    fill in slots for the group select element
+
+    returns list of groups, oldest first
+    '''
+    groups = sorted(data['groups'],
+                    key=lambda g: data['groups'][g]['timestamp'])
+    slots['contents'] = escape_attribute(':'.join([''] + groups))
+    before, after = TEMPLATES['options']
+    options = [before, TEMPLATES['option', 'default'] if groups else
+               TEMPLATES['option', 'default', 'selected'], after]
+    for group in groups:
+        option = {'value': escape_attribute(group), 'text': escape_text(group)}
+        options.append(TEMPLATES['option', 'selected'] % option
+                       if group == groups[-1] else
+                       TEMPLATES['option'] % option)
+    slots['options'] = ''.join(options)
+    return groups
+
+def render_grouplist(data):
+    '''
+    the group select element alone, for the joinform page to poll
+
+    >>> print(render_grouplist({'groups': {'a&b': {'timestamp': 0}}}))
+    <select id="group-select" name="group" data-contents=":a&amp;b">
+            <option value="">(Create new group)</option>
+           <option value="a&amp;b" selected>a&amp;b</option></select>
+    <BLANKLINE>
+    '''
+    slots = {}
+    grouplist_slots(data, slots)
+    return TEMPLATES['grouplist'] % slots
+
+def report(group, data=None):
+    '''
+    rows of the report table, and the report page, for a finished group
+
+    normally these were rendered when the group finished; otherwise
+    render them now. raises KeyError if there's no such finished group.
+
     >>> data = json.loads("""{"finished": {"test": {"groupname": "test",
-    ...  "participants": {"jc": {"spoke": 48.5}, "Ed": {"spoke": 3.25}}}}}""")
-    >>> formatting = {'pretty_print': True, 'with_tail': False}
-    >>> print(create_report(parsed, 'test', data, **formatting).decode('utf8'))
+    ...  "participants": {"Ed": {"spoke": 3.25}, "jc": {"spoke": 48.5}}}}}""")
+    >>> rows, page = report('test', data)
+    >>> print(page.decode('ascii'))
     <div id="report-body" class="body">
-     <div id="report-wrapper" class="pagewrapper top">
-      <div id="report-box" class="box">
-       <table>
-        <tr>
-    <th>Name</th>
-    <th>Elapsed Time</th>
-    </tr>
-        <tr>
-    <td>jc</td>
-    <td>00:00:48</td>
-    </tr>
-       <tr>
-    <td>Ed</td>
-    <td>00:00:03</td>
-    </tr>
-       </table>
-      </div>
-    <!-- box -->
+      <div id="report-wrapper" class="pagewrapper top">
+       <div id="report-box" class="box">
+        <table id="report-table">
+         <tr><th>Name</th><th>Elapsed Time</th></tr>
+         <tr><td>jc</td><td>00:00:48</td></tr>
+        <tr><td>Ed</td><td>00:00:03</td></tr>
+        </table>
+       </div><!-- box -->
+      </div><!-- pagewrapper -->
      </div>
-    <!-- pagewrapper -->
-    </div>
-    <BLANKLINE>
     '''
-    parsed = parsed if parsed is not None else copy.deepcopy(PARSED)
+    if group in REPORTS:
+        return REPORTS[group]
+    return render_report(finished_group(group, data))
+
+def finished_group(group, data=None):
+    '''
+    a finished group, from memory if it's one of the last MAXFINISHED,
+    otherwise from ARCHIVE. raises KeyError if there's no such group.
+    '''
     data = data or DATA
-    body_div = parsed.xpath('//*[@id="report-body"]')[0]
-    rows = body_div.xpath('.//table/tr')
-    debug('report', 'create_report: rows: %s', rows)
-    template = rows[1]
-    table = template.getparent()
-    table.remove(template)
     try:
-        participants = data['finished'][group]['participants']
-    except KeyError as nosuchgroup:
-        logging.warning('No such group %s', nosuchgroup)
-        participants = {}
-    speakers = sorted(participants, key=lambda u: -participants[u]['spoke'])
-    columns = template.xpath('./td')
-    debug('report', 'create_report: speakers: %s', speakers)
-    for speaker in speakers:
-        debug('report', 'adding speaker "%s" to report', speaker)
-        columns[0].text = speaker
-        columns[1].text = formatseconds(participants[speaker]['spoke'])
-        debug('report', 'template now: %s', html.tostring(template))
-        table.append(html.fromstring(html.tostring(template)))
-        debug('report', 'table now: %s', html.tostring(table))
-    return html.tostring(body_div, **formatting)
-
-def set_text(parsed, idlist, values):
-    '''
-    pre-set page text
-    '''
-    debug('all', 'setting values of %s from %s', idlist, values)
-    for index in range(len(idlist)):
-        elementid = idlist[index]
-        value = values[index]
-        element = parsed.xpath('//*[@id="%s"]' % elementid)[0]
-        debug('all', 'before: %s', html.tostring(element))
-        element.text = value
-        debug('all', 'after: %s', html.tostring(element))
-
-def set_button(parsed, idlist, values):
-    '''
-    modify button values
-
-    >>> content = html.fromstring('<div><input id="test" value="Test"></div>')
-    >>> set_button(content, ['test'], ['new value'])
-    >>> content.xpath('//*[@id="test"]')[0].get('value')
-    'new value'
-    '''
-    for index in range(len(idlist)):
-        elementid = idlist[index]
-        value = values[index]
-        element = parsed.xpath('//*[@id="%s"]' % elementid)[0]
-        debug('buttons', 'before: %s', html.tostring(element))
-        element.set('value', value)
-        debug('buttons', 'after: %s', html.tostring(element))
-
-def set_values(parsed, postdict, fieldlist):
-    '''
-    pre-set form input values from postdict
-    '''
-    debug('hidden', 'setting values of %s from %s', fieldlist, postdict)
-    for fieldname in fieldlist:
-        value = postdict.get(fieldname, '')
-        if not value:
-            debug('hidden', 'skipping %s, no value found', fieldname)
-            continue
-        elements = parsed.xpath('//input[@name="%s"]' % fieldname)
-        for element in elements:
-            debug('hidden', 'before: %s', html.tostring(element))
-            element.set('value', value)
-            debug('hidden', 'after: %s', html.tostring(element))
+        return data['finished'][group]
+    except KeyError:
+        groupdata = BACKEND.archived(group)
+        if groupdata is None:
+            raise
+        return groupdata
 
-def populate_grouplist(parsed=None, data=None, formatted='list', **options):
+def render_report(groupdata):
     '''
-    fill in 'select' element with options for each available group
+    render report table rows, and the whole report page as bytes
+    '''
+    rows = report_rows(groupdata)
+    slots = dict(SLOTS, rows=rows)
+    return rows, (TEMPLATES['report'] % slots).encode('ascii')
 
-    if `formatted` is 'list', just return list of groups, oldest first
+def report_rows(groupdata):
+    '''
+    rows of the report table, most talkative speakers first
+    '''
+    participants = groupdata['participants']
+    speakers = sorted(participants,
+                      key=lambda u: -participants[u].get('spoke', 0))
+    return ''.join(TEMPLATES['row'] % {
+        'name': escape_text(speaker),
+        'time': formatseconds(participants[speaker].get('spoke', 0))}
+                   for speaker in speakers)
 
-    >>> options = {'pretty_print': True, 'with_tail': False}
-    >>> data = {'groups': {'test': {'timestamp': 0}, 'again': {'timestamp': 1}}}
-    >>> print(populate_grouplist(None, data, 'element', **options))
-    <select id="group-select" name="group" data-contents=":test:again">
-            <option value="">(Create new group)</option>
-           <option value="test">test</option>
-    <option value="again" selected>again</option></select>
-    <BLANKLINE>
-    >>> data['groups']['test']['timestamp'] = 2
-    >>> populate_grouplist(None, data)
-    ['again', 'test']
+def escape_text(text):
     '''
-    # sorting a dict gives you a list of keys
-    data = data or DATA
-    session_key = data.get('httpsession_key', None)
-    session = HTTPSESSIONS.get(session_key, {})
-    added_group = session.get('added_group', None)
-    parsed = parsed if parsed is not None else html.fromstring(PAGE)
-    groups = sorted(data['groups'],
-                    key=lambda g: data['groups'][g]['timestamp'])
-    contents = ':'.join([''] + groups)
-    grouplist = parsed.xpath('//select[@name="group"]')[0]
-    debug('grouplist', 'populate_grouplist: %s', grouplist)
-    for group in groups:
-        newgroup = builder.OPTION(group, value=group)
-        grouplist.append(newgroup)
-    # make newest group the "selected" one
-    # except for someone who just created a group, mark *that* one selected
-    for group in grouplist.getchildren():
-        try:
-            del group.attrib['selected']
-        except KeyError:
-            pass
-    try:
-        grouplist[grouplist.index(added_group)].set('selected', 'selected')
-    except (KeyError, ValueError, IndexError, TypeError):
-        grouplist[-1].set('selected', 'selected')
-    grouplist.set("data-contents", contents)
-    if formatted == 'list':
-        return groups
-    else:
-        return html.tostring(grouplist, **options).decode()
+    escape text content exactly the way lxml.html.tostring does
 
-def hide_except(keep, tree):
+    >>> escape_text('<"Ed" & L\u00fc>')
+    '&lt;"Ed" &amp; L&#252;&gt;'
     '''
-    set "display: none" for all sections of the page we don't want to see
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;')
+            .encode('ascii', 'xmlcharrefreplace').decode('ascii'))
+
+def escape_attribute(value):
     '''
-    for page in tree.xpath('//div[@class="body"]'):
-        if not page.get('id').startswith(keep):
-            page.set('style', 'display: none')
-        elif 'style' in page.attrib:
-            del page.attrib['style']
+    quote attribute value exactly the way lxml.html.tostring does
 
-def data_merge(data, cookie):
+    >>> print(escape_attribute('<Ed & L\u00fc> &{x}'))
+    "&lt;Ed &amp; L&#252;&gt; &{x}"
+    >>> print(escape_attribute('"Ed"'), escape_attribute('"Ed\\'s"'))
+    '"Ed"' "&quot;Ed's&quot;"
     '''
-    anything missing in data['postdict'] gets set from cookie if found
+    value = (re.sub('&(?![{])', '&amp;', value).replace('<', '&lt;')
+             .replace('>', '&gt;')
+             .encode('ascii', 'xmlcharrefreplace').decode('ascii'))
+    if '"' in value and "'" not in value:
+        return "'%s'" % value
+    return '"%s"' % value.replace('"', '&quot;')
+
+def data_merge(data, cookies):
     '''
-    if cookie:
-        if not data['postdict'].get('username'):
-            logging.debug('data_merge: setting username from cookie')
-            data['postdict']['username'] = cookie['username'].value
+    anything missing in data['postdict'] gets set from cookies if found
+    '''
+    if cookies:
+        if 'username' in cookies and not data['postdict'].get('username'):
+            debug('sessions', 'data_merge: setting username from cookie')
+            data['postdict']['username'] = cookies['username']
         else:
-            logging.debug('data_merge: found username already in postdict')
-        if not data['postdict'].get('http_sessionkey'):
-            logging.debug('data_merge: setting session key from cookie')
-            data['postdict']['http_sessionkey'] = cookie['sessionid'].value
+            debug('sessions',
+                  'data_merge: username already in postdict or absent')
+        if 'sessionid' in cookies and not data['postdict'].get(
+                'http_sessionkey'):
+            debug('sessions', 'data_merge: setting session key from cookie')
+            data['postdict']['http_sessionkey'] = cookies['sessionid']
         else:
-            logging.debug('data_merge: session key already in postdict')
+            debug('sessions',
+                  'data_merge: session key in postdict or absent')
     else:
-        logging.debug('data_merge: cookie: %r, postdict: %s',
-                      cookie, data.get('postdict'))
+        debug('sessions', 'data_merge: cookies: %r, postdict: %s',
+              cookies, data.get('postdict'))
 
 def server(env=None, start_response=None):
     '''
     primary server process, sends page with current groups list
     '''
+    began = time.perf_counter()
     status_code, mimetype, page = '500 Server error', 'text/html', '(Unknown)'
+    headers = []
     start, path = findpath(env)
     cookie, data = handle_post(env)
-    logging.debug('server: cookie: %s', cookie)
-    data_merge(data, cookie)  # set any missing data from cookie
-    debug('all', 'server: data: %s', data)
+    debug('sessions', 'server: cookie: %s', cookie)
+    # set any missing data from the browser's cookies
+    data_merge(data, parse_cookies(env.get('HTTP_COOKIE', '')))
+    debug('data', 'server: data: %s', data)  # all of it, so not in 'all'
     if path in ('groups',):
-        page = populate_grouplist(None, data, formatted='element')
+        page = render_grouplist(data)
         status_code = '200 OK'
     elif path.startswith('report/'):
         group = path.split('/')[1]
-        page = create_report(group=group).decode('utf8')
+        try:
+            page = report(group, data)[1]
+        except KeyError as nosuchgroup:
+            logging.warning('No such group %s', nosuchgroup)
+            page = render_report({'participants': {}})[1]
         status_code = '200 OK'
-    elif path.startswith('groups/'):
+    elif path.startswith(('groups/', 'talksession/')):
         group = path.split('/')[1]
-        try:
-            page = json.dumps(data['groups'][group])
-        except KeyError as groupname:
-            debug('all', 'group %s does not exist in %s', groupname, data)
-            page = '{}'
+        if path.startswith('groups/'):
+            etag, page = group_json(group, data)
+        else:
+            since = urllib.parse.parse_qs(env.get('QUERY_STRING', ''))
+            etag, page = talksession_json(group, data,
+                                          since.get('since', [None])[0])
+        mimetype = 'application/json'
+        if etag is not None:
+            # browsers revalidate with If-None-Match on every poll
+            headers.extend([('ETag', etag), ('Cache-Control', 'no-cache')])
+        if etag is not None and env.get('HTTP_IF_NONE_MATCH') == etag:
+            status_code, page = '304 Not Modified', b''
+        else:
+            status_code = '200 OK'
+    elif path.startswith('heartbeat/'):
+        query = urllib.parse.parse_qs(env.get('QUERY_STRING', ''))
+        since = query.get('since', [''])[0]
+        page = heartbeat(path.split('/')[1], data,
+                         query.get('username', [None])[0],
+                         int(since) if since.isdigit() else None)
+        mimetype = 'application/octet-stream'
+        headers.append(('Cache-Control', 'no-cache'))
+        status_code = '200 OK'
+    elif path.startswith('events/'):
+        # only reached when the event server isn't running. send current
+        # state and have the EventSource reconnect soon, so it polls.
+        group = path.split('/')[1]
+        etag, payload = talksession_json(group, data)
+        page = b'retry: 500\n' + sse('group' if etag else 'finished', payload)
+        mimetype = 'text/event-stream'
+        headers.append(('Cache-Control', 'no-cache'))
         status_code = '200 OK'
     elif path in ('', 'noscript', 'app'):
         page = loadpage(path, data)
         status_code = '200 OK'
     elif path == 'status':
-        page = escape(json.dumps(data))
+        page = escape(json.dumps(dict(data, sessions=BACKEND.sessions())))
         status_code = '200 OK'
+    elif path == 'metrics':
+        page = metrics(data)
+        mimetype = 'text/plain; version=0.0.4'
+        status_code = '200 OK'
+    elif path == 'profile':
+        query = urllib.parse.parse_qs(env.get('QUERY_STRING', ''))
+        try:
+            seconds = float(query.get('seconds', [10])[0])
+        except ValueError:
+            seconds = None
+        if not (PROFILEKEY and hmac.compare_digest(
+                query.get('key', [''])[0].encode(), PROFILEKEY.encode())):
+            status_code, page = '403 Forbidden', '<h1>Forbidden</h1>'
+        elif seconds is None or not seconds > 0:  # also rules out nan
+            status_code, page = '400 Bad Request', '<h1>Bad Request</h1>'
+        else:
+            page = profile(min(seconds, 300))
+            mimetype, status_code = 'text/plain', '202 Accepted'
     else:
         try:
-            page, mimetype = render(os.path.join(start, path))
-            status_code = '200 OK'
+            asset = render(os.path.join(start, path))
+            mimetype = asset['mimetype']
+            headers.extend([('ETag', asset['etag']),
+                            ('Cache-Control', 'no-cache')])
+            if asset['gzip'] is not None:
+                headers.append(('Vary', 'Accept-Encoding'))
+            if env.get('HTTP_IF_NONE_MATCH') == asset['etag']:
+                status_code, page = '304 Not Modified', b''
+            else:
+                status_code, page = '200 OK', asset['body']
+                if (asset['gzip'] is not None and
+                        'gzip' in env.get('HTTP_ACCEPT_ENCODING', '')):
+                    page = asset['gzip']
+                    headers.append(('Content-Encoding', 'gzip'))
+                headers.append(('Content-Length', str(len(page))))
         except (IOError, OSError) as filenotfound:
             status_code = '404 File not found'
             page = '<h1>No such page: %s</h1>' % str(filenotfound)
-    headers = [('Content-type', mimetype)]
+    headers.insert(0, ('Content-type', mimetype))
     if cookie is not None:
-        logging.debug('setting cookie headers %r', cookie.output())
+        debug('sessions', 'setting cookie headers for %r', cookie)
         headers.extend(cookie_headers(cookie))
     start_response(status_code, headers)
     debug('all', 'page: %s', page[:128])
-    return [page.encode('utf8')]
+    page = page if isinstance(page, bytes) else page.encode('utf8')
+    route = path.split('/')[0]
+    observe('request_seconds', time.perf_counter() - began,
+            route if route in ROUTES else 'index' if not path else 'static')
+    return [page]
+
+def observe(name, seconds, label=''):
+    '''
+    count a timing in its histogram, if METRICS are being kept
+
+    no lock is taken: it would cost more than the rest of this put
+    together. a count can be lost, very rarely, if two threads add to the
+    same bucket at once.
+
+    >>> observe('test_seconds', .0002, 'doctest')
+    >>> observe('test_seconds', 7, 'doctest')
+    >>> HISTOGRAMS['test_seconds', 'doctest'][2:4], HISTOGRAMS[
+    ...  'test_seconds', 'doctest'][-2:]
+    ([0, 1], [1, 7.0002])
+    '''
+    if not METRICS:
+        return
+    try:
+        counts = HISTOGRAMS[name, label]
+    except KeyError:
+        counts = histogram(name, label)
+    counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+    counts[-1] += seconds
+
+def histogram(name, label=''):
+    '''
+    the counts of a histogram, made empty if it's new
+    '''
+    return HISTOGRAMS.setdefault((name, label),
+                                 [0] * (len(BUCKETS) + 1) + [0.0])
+
+def histogram_lines(name, labelname):
+    '''
+    Prometheus text lines for all of one histogram's labels
+
+    >>> HISTOGRAMS['test_seconds', 'x'] = [1] + [0] * 11 + [2, 9.5]
+    >>> print('\\n'.join(histogram_lines('test_seconds', 'path')[-4:]))
+    myturn_test_seconds_bucket{path="x",le="5"} 1
+    myturn_test_seconds_bucket{path="x",le="+Inf"} 3
+    myturn_test_seconds_sum{path="x"} 9.5
+    myturn_test_seconds_count{path="x"} 3
+    '''
+    lines = []
+    for (histogram, label), counts in sorted(list(HISTOGRAMS.items())):
+        if histogram != name:
+            continue
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            total += count
+            lines.append('myturn_%s_bucket{%s="%s",le="%s"} %d' % (
+                name, labelname, label, bound, total))
+        lines.append('myturn_%s_sum{%s="%s"} %r' % (
+            name, labelname, label, counts[-1]))
+        lines.append('myturn_%s_count{%s="%s"} %d' % (
+            name, labelname, label, total))
+    return lines
+
+def metrics(data):
+    '''
+    page for /metrics, in Prometheus text format
+
+    the histograms are this process's only, since it started. the gauges
+    are worked out now, from `data`.
+    '''
+    lines = []
+    for name, (labelname, helptext) in HISTOGRAMHELP.items():
+        lines.extend(['# HELP myturn_%s %s' % (name, helptext),
+                      '# TYPE myturn_%s histogram' % name])
+        lines.extend(histogram_lines(name, labelname))
+    gauges = [
+        ('groups', 'active groups', len(data['groups'])),
+        ('participants', 'participants in active groups',
+         sum(len(groupdata.get('participants', ()))
+             for groupdata in data['groups'].values())),
+        ('finished', 'finished groups in memory', len(data['finished'])),
+        ('sessions', 'live http sessions', BACKEND.sessions()['live']),
+        ('threads', 'threads in this process', threading.active_count()),
+    ]
+    for name, helptext, value in gauges:
+        lines.extend(['# HELP myturn_%s %s' % (name, helptext),
+                      '# TYPE myturn_%s gauge' % name,
+                      'myturn_%s %d' % (name, value)])
+    return '\n'.join(lines) + '\n'
+
+def profile(seconds):
+    '''
+    sample the stacks of all threads for `seconds`, in the background
+
+    returns the name of the file the samples will be written to, in the
+    collapsed-stack format of flamegraph.pl and speedscope. if a profile is
+    already being taken, it's that one's file. nothing at all is done
+    while no profile is being taken.
+    '''
+    with PROFILELOCK:
+        if not PROFILING:
+            filename = os.path.join(PROFILES, '%s-%d.collapsed' % (
+                time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+            PROFILING.append(threading.Thread(
+                target=sample, name='profiler', args=(seconds, filename)))
+            PROFILING[0].daemon = True
+            PROFILING[0].filename = filename
+            PROFILING[0].start()
+        logging.warning('profiling for %s seconds into %s', seconds,
+                        PROFILING[0].filename)
+        return PROFILING[0].filename
+
+def sample(seconds, filename, interval=SAMPLE):
+    '''
+    count the stacks of every other thread, every `interval` seconds
+
+    each stack starts with the thread's name, so that the scheduler's time
+    is split by the group it was working for.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'test.collapsed')
+    ...     thread = threading.Thread(target=sample,
+    ...                               args=(.05, filename, .01))
+    ...     thread.start(), thread.join()
+    ...     with open(filename) as infile:
+    ...         stacks = infile.read().splitlines()
+    (None, None)
+    >>> any(stack.startswith('MainThread;') for stack in stacks)
+    True
+    '''
+    try:
+        stacks = defaultdict(int)
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append('%s (%s:%d)' % (
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                frames.append(str(names.get(ident, ident)))
+                stacks[';'.join(name.replace(';', ',')
+                                for name in reversed(frames))] += 1
+            time.sleep(interval)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename + '.tmp', 'w') as outfile:
+            outfile.write(''.join('%s %d\n' % (stack, count)
+                                  for stack, count in sorted(stacks.items())))
+        os.replace(filename + '.tmp', filename)
+    finally:
+        with PROFILELOCK:
+            if PROFILING and PROFILING[0].ident == threading.get_ident():
+                PROFILING.pop()
+
+class MeteredLock():
+    '''
+    lock that times how long it's waited for and held, for /metrics
+
+    >>> lock = MeteredLock('doctest')
+    >>> with lock:
+    ...     pass
+    >>> sum(HISTOGRAMS['lock_held_seconds', 'doctest'][:-1])
+    1
+    '''
+    __slots__ = ('lock', 'name', 'acquired', 'waits')
+
+    def __init__(self, name):
+        self.lock = threading.Lock()
+        self.name = name
+        self.acquired = 0
+        self.waits = histogram('lock_wait_seconds', name)
+
+    def __enter__(self):
+        if self.lock.acquire(False):  # the usual case, no waiting at all
+            self.waits[0] += 1
+        else:
+            began = time.perf_counter()
+            self.lock.acquire()
+            observe('lock_wait_seconds', time.perf_counter() - began,
+                    self.name)
+        self.acquired = time.perf_counter()
+
+    def __exit__(self, *args):
+        held = time.perf_counter() - self.acquired
+        self.lock.release()
+        observe('lock_held_seconds', held, self.name)
+
+def subscribe(group, listener):
+    '''
+    have listener(event, data) called on every change to the group
+    '''
+    with EVENTS:
+        LISTENERS[group].add(listener)
+
+def unsubscribe(group, listener):
+    '''
+    stop sending events to listener
+    '''
+    with EVENTS:
+        LISTENERS[group].discard(listener)
+        if not LISTENERS[group]:
+            del LISTENERS[group]
+
+def announce(group, event, data):
+    '''
+    send event to everyone listening to the group
+
+    called by `publish` with the lock held, so listeners must only queue
+    the event, not send it.
+
+    >>> subscribe('test', print)
+    >>> announce('test', 'group', b'{}')
+    group b'{}'
+    >>> unsubscribe('test', print)
+    >>> announce('test', 'group', b'{}')
+    '''
+    with EVENTS:
+        listeners = list(LISTENERS.get(group, ()))
+    for listener in listeners:
+        listener(event, data)
+
+def sse(event, data):
+    '''
+    format one Server-Sent Event; data must be a single line
+
+    >>> sse('group', b'{}')
+    b'event: group\\ndata: {}\\n\\n'
+    '''
+    return b'event: %s\ndata: %s\n\n' % (event.encode(), data)
+
+def remaining_json(group, data):
+    '''
+    just the clock part of an active group, for keeping event streams alive
+
+    >>> remaining_json('test', {'groups': {'test': {'talksession': {
+    ...  'clock': 0, 'ending': 60}}}})
+    b'{"remaining": 0, "tick": 240}'
+    '''
+    now = time.monotonic()
+    talksession = data['groups'][group].get('talksession', {})
+    return json.dumps({
+        'remaining': max(0, talksession.get('ending', now) - now),
+        'tick': ticks(talksession, now),
+    }).encode()
+
+def eventserver(address):
+    '''
+    run the asyncio server in a thread of its own, alongside uwsgi
+
+    a single asyncio loop handles all the connections, so a client waiting
+    for events doesn't tie up one of the few uwsgi cores. `address` is
+    host:port, or the path of a unix socket for nginx to proxy to.
+    '''
+    thread = threading.Thread(target=asyncio.run, name='events',
+                              args=(serve(address),))
+    thread.daemon = True  # leave no zombies on exit
+    thread.start()
+    return thread
+
+async def serve(address):
+    '''
+    asyncio HTTP/1.1 server, forever
+
+    this is the alternative to running under uwsgi: one process, one
+    thread for the event loop, thousands of keep-alive and event stream
+    connections. everything except the streams is handled by `server`,
+    in the loop's default thread pool, so it behaves exactly like uwsgi.
+    '''
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        listener = await asyncio.start_server(handle_connection, host,
+                                              int(port))
+    else:
+        if os.path.exists(address):
+            os.unlink(address)  # left over from before a restart
+        listener = await asyncio.start_unix_server(handle_connection, address)
+        os.chmod(address, 0o666)  # so nginx can connect to it
+    logging.info('asyncio server listening on %s', address)
+    async with listener:
+        await listener.serve_forever()
+
+async def handle_connection(reader, writer):
+    '''
+    serve requests from one client until it closes the connection
+
+    an event stream request is the last one on its connection.
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                              KEEPALIVE)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                break  # idle too long, or client closed connection
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+            headers = [tuple(field.strip() for field in line.split(':', 1))
+                       for line in lines[1:] if line]
+            fields = {name.lower(): value for name, value in headers}
+            length = int(fields.get('content-length', 0))
+            if length > MAXBODY:
+                writer.write(b'HTTP/1.1 413 Request Entity Too Large\r\n'
+                             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            body = await reader.readexactly(length)
+            path = urllib.parse.unquote(target).split('?')[0].lstrip('/')
+            if path.startswith('events/'):
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: text/event-stream\r\n'
+                             b'Cache-Control: no-cache\r\n'
+                             b'X-Accel-Buffering: no\r\n\r\n')
+                async for chunk in events(path.split('/')[1]):
+                    writer.write(chunk)
+                    await writer.drain()
+                break
+            status, headers, page = await loop.run_in_executor(
+                None, respond, wsgi_environ(method, target, headers, body))
+            keepalive = (version == 'HTTP/1.1' and
+                         fields.get('connection', '').lower() != 'close')
+            if not any(name == 'Content-Length' for name, value in headers):
+                headers.append(('Content-Length', str(len(page))))
+            headers.append(('Connection',
+                            'keep-alive' if keepalive else 'close'))
+            writer.write(('HTTP/1.1 %s\r\n' % status).encode('latin-1') +
+                         ''.join('%s: %s\r\n' % header for header in headers)
+                         .encode('latin-1') + b'\r\n' + page)
+            await writer.drain()
+            if not keepalive:
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError) as problem:
+        debug('asyncio', 'closing connection: %r', problem)
+    finally:
+        writer.close()
+
+async def events(group):
+    '''
+    Server-Sent Events for a group, until its talksession is over
+
+    starts with the group's current state, then sends every change as it
+    is published, plus a `remaining` event every PING seconds when nothing
+    else is happening.
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    def listener(event, data):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+    subscribe(group, listener)
+    try:
+        etag, data = talksession_json(group, snapshot())
+        event = 'group' if etag else 'finished'
+        while True:
+            yield sse(event, data)
+            if event == 'finished':
+                break
+            try:
+                event, data = await asyncio.wait_for(queue.get(), PING)
+                while not queue.empty():  # only the latest state matters
+                    event, data = queue.get_nowait()
+            except asyncio.TimeoutError:
+                try:
+                    event, data = 'remaining', remaining_json(group,
+                                                              snapshot())
+                except KeyError:
+                    event, data = 'finished', b'{}'
+    finally:
+        unsubscribe(group, listener)
+
+async def asgi(scope, receive, send):
+    '''
+    ASGI application, e.g. `uvicorn myturn:asgi`, as an alternative to `serve`
+    '''
+    start()
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.shutdown':
+                return await send({'type': 'lifespan.shutdown.complete'})
+            await send({'type': 'lifespan.startup.complete'})
+    elif scope['type'] != 'http':
+        return
+    body, more = b'', True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+        if len(body) > MAXBODY:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': []})
+            return await send({'type': 'http.response.body'})
+    target = (scope.get('raw_path', b'').decode('latin-1') or
+              urllib.parse.quote(scope['path']))
+    if scope.get('query_string'):
+        target += '?' + scope['query_string'].decode('latin-1')
+    if scope['path'].startswith('/events/'):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache')]})
+        return await stream(events(scope['path'].split('/')[2]), receive, send)
+    headers = [(name.decode('latin-1'), value.decode('latin-1'))
+               for name, value in scope['headers']]
+    status, headers, page = await asyncio.get_running_loop().run_in_executor(
+        None, respond, wsgi_environ(scope['method'], target, headers, body))
+    await send({'type': 'http.response.start', 'status': int(status[:3]),
+                'headers': [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': page})
+
+async def stream(chunks, receive, send):
+    '''
+    send an event stream over ASGI until it ends or the client goes away
+
+    a `send` after the client has gone may just be ignored, so `receive`
+    is watched for the disconnect, or the stream would go on forever.
+    '''
+    async def forward():
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': True})
+        await send({'type': 'http.response.body'})
+    async def disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    tasks = [asyncio.ensure_future(forward()),
+             asyncio.ensure_future(disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()  # so `events` unsubscribes
+
+def wsgi_environ(method, target, headers, body):
+    '''
+    WSGI environment for a request received outside of uwsgi
+
+    >>> env = wsgi_environ('POST', '/app?debug=load',
+    ...  [('Content-Type', 'text/plain'), ('Cookie', 'a=b')], b'x')
+    >>> env['REQUEST_URI'], env['CONTENT_LENGTH'], env['HTTP_COOKIE']
+    ('/app?debug=load', '1', 'a=b')
+    '''
+    path, _, query = target.partition('?')
+    env = {
+        'REQUEST_METHOD': method,
+        'REQUEST_URI': target,
+        'PATH_INFO': urllib.parse.unquote(path),
+        'QUERY_STRING': query,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            env[key] = value
+        elif key != 'CONTENT_LENGTH':
+            env['HTTP_' + key] = value
+    return env
+
+def respond(env):
+    '''
+    call `server` and return status, headers, and body all at once
+    '''
+    response = {}
+    def start_response(status, headers):
+        response.update(status=status, headers=headers)
+    page = b''.join(server(env, start_response))
+    return response['status'], list(response['headers']), page
 
 def cookie_headers(cookie):
     '''
@@ -430,6 +1173,76 @@ def cookie_headers(cookie):
     cookies = cookie.output().split('\r\n')
     return [tuple(re.compile(': ').split(c, 1)) for c in cookies]
 
+def parse_form(env):
+    '''
+    first value of each field of a POSTed form, urlencoded or multipart
+
+    values in the query string are used only for fields not in the body,
+    and blank urlencoded values are left out, as cgi.FieldStorage did.
+    a body over MAXBODY bytes is not read at all, leaving an empty form.
+
+    >>> parse_form(wsgi_environ('POST', '/app?submit=Join', [
+    ...  ('Content-Type', 'application/x-www-form-urlencoded')],
+    ...  b'username=j%C3%A9&group=&username=x'))
+    {'username': 'jé', 'submit': 'Join'}
+    >>> parse_form(wsgi_environ('POST', '/groups/test', [
+    ...  ('Content-Type', 'multipart/form-data; boundary=----x')],
+    ...  b'------x\\r\\nContent-Disposition: form-data; name="groupname"'
+    ...  b'\\r\\n\\r\\ntest\\r\\n------x\\r\\n'
+    ...  b'Content-Disposition: form-data; name="submit"\\r\\n\\r\\n'
+    ...  b'My Turn\\r\\n------x--\\r\\n'))
+    {'groupname': 'test', 'submit': 'My Turn'}
+    '''
+    form = {}
+    length = int(env.get('CONTENT_LENGTH') or 0)
+    if length > MAXBODY:
+        logging.warning('ignoring form of %d bytes', length)
+        return form
+    body = env['wsgi.input'].read(length) if length else b''
+    contenttype = env.get('CONTENT_TYPE', '')
+    if contenttype.startswith('multipart/form-data'):
+        boundary = BOUNDARY.search(contenttype)
+        parts = body.split(b'--' + boundary.group(1).encode('latin-1')) \
+            if boundary else []
+        for part in parts[1:]:
+            if part.startswith(b'--'):
+                break  # the closing delimiter
+            head, _, value = part.partition(b'\r\n\r\n')
+            name = PARTNAME.search(head)
+            if name:
+                form.setdefault(name.group(1).decode('utf8', 'replace'),
+                                value[:-2].decode('utf8', 'replace'))
+    else:
+        for name, value in urllib.parse.parse_qsl(
+                body.decode('utf8', 'replace')):
+            form.setdefault(name, value)
+    for name, value in urllib.parse.parse_qsl(env.get('QUERY_STRING', '')):
+        form.setdefault(name, value)
+    return form
+
+def parse_cookies(header):
+    '''
+    cookies sent by the browser, as a dict of their values
+
+    quoted values are unquoted the way SimpleCookie quoted them.
+
+    >>> parse_cookies('sessionid=abc; username="J\\\\351 \\\\"Q\\\\""')
+    {'sessionid': 'abc', 'username': 'Jé "Q"'}
+    >>> parse_cookies('')
+    {}
+    '''
+    cookies = {}
+    for item in header.split(';'):
+        name, equals, value = item.strip().partition('=')
+        if equals:
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = COOKIEQUOTED.sub(
+                    lambda match: chr(int(match.group(1), 8))
+                    if match.group(1) else match.group(2), value[1:-1])
+            cookies.setdefault(name.strip(), value)
+    return cookies
+
 def handle_post(env):
     '''
     process the form submission and return data structures
@@ -447,22 +1260,35 @@ def handle_post(env):
     one value.
 
     parse_qs will instead return a dict of lists.
+
+    the cookie returned is only the one to set, if any; the browser's
+    own cookies are left for `data_merge`.
     '''
-    uwsgi.lock()  # lock access to DATA global
     worker = getattr(uwsgi, 'worker_id', lambda *args: None)()
-    DATA['handler'] = (worker, env.get('uwsgi.core'))
+    handler = (worker, env.get('uwsgi.core'))
     timestamp = datetime.datetime.utcnow().timestamp()
-    cookie = SimpleCookie(env['HTTP_COOKIE']) if 'HTTP_COOKIE' in env else None
+    if env.get('REQUEST_METHOD') != 'POST':
+        # nothing to change, so no need to wait for the lock
+        return None, snapshot(postdict={}, handler=handler)
+    postdict = parse_form(env)
+    debug('all', 'handle_post: postdict: %s', postdict)
+    postdict['timestamp'] = timestamp
+    cookie, postdict = BACKEND.apply(postdict)
+    # the view is taken after unlocking; it is never modified by writers
+    return cookie, snapshot(postdict=postdict, handler=handler)
+
+def apply(postdict, cookie=None):
+    '''
+    make the change to DATA a form submission asks for
+
+    returns the cookie to set, and postdict with anything added for
+    `loadpage`, like the text of an error. only the group being changed
+    is locked.
+    '''
+    timestamp = postdict['timestamp']
     try:
-        if env.get('REQUEST_METHOD') != 'POST':
-            DATA['postdict'] = {}
-            return cookie, copy.deepcopy(DATA)
-        form = cgi.FieldStorage(fp=env['wsgi.input'], environ=env)
-        DATA['postdict'] = postdict = {k: form.getfirst(k) for k in form.keys()}
-        debug('all', 'handle_post: %s, postdict: %s', form, postdict)
         # [groupname, total, turn] and submit=Submit if group creation
         # [username, group] and submit=Join if joining a group
-        postdict['timestamp'] = timestamp
         if not postdict.get('httpsession_key'):
             postdict['httpsession_key'] = uuid.uuid4().hex
             debug('sessions', 'set httpsession_key = %s',
@@ -471,7 +1297,8 @@ def handle_post(env):
             buttonvalue = postdict['submit']
         except KeyError:
             raise ValueError('No "submit" button found')
-        cookie = update_httpsession(postdict)
+        with SESSIONLOCK:
+            cookie = update_httpsession(postdict)
         if buttonvalue == 'Join':
             # username being added to group
             # don't allow if name already in group
@@ -482,100 +1309,661 @@ def handle_post(env):
             if not username:
                 raise ValueError('Name field cannot be empty')
             elif group in groups:
-                postdict['groupname'] = group
-                if username in groups[group]['participants']:
-                    raise ValueError('"%s" is already a member of %s' % (
-                        username, group))
-                groups[group]['participants'][username] = defaultdict(
-                    float,  # for `speaking` and `spoke` times
-                    {'timestamp': timestamp, 'requests': []}
-                )
-                postdict['joined'] = '%s:%s' % (username, group)
-                if 'talksession' not in groups[group]:
-                    groups[group]['talksession'] = {
-                        'start': timestamp,
-                        'speaker': None,
-                        'tick': 0,
-                    }
-                    counter = threading.Thread(
-                        target=countdown,
-                        name=group,
-                        args=(group,))
-                    counter.daemon = True  # leave no zombies on exit
-                    counter.start()
+                # no lock is made for a group that doesn't exist
+                with grouplock(group):
+                    if group not in groups:
+                        raise SystemError('Group %s is no longer active' %
+                                          group)
+                    postdict['groupname'] = group
+                    if username in groups[group]['participants']:
+                        raise ValueError('"%s" is already a member of %s' % (
+                            username, group))
+                    groups[group]['participants'][username] = defaultdict(
+                        float,  # for `speaking` and `spoke` times
+                        {'timestamp': timestamp, 'requests': []}
+                    )
+                    postdict['joined'] = '%s:%s' % (username, group)
+                    if 'talksession' not in groups[group]:
+                        groups[group]['talksession'] = {
+                            'start': timestamp,
+                            'speaker': None,
+                        }
+                        countdown(group)
+                    publish(group, event='join')
             # else group not in groups, no problem, return to add group form
-            return cookie, copy.deepcopy(DATA)
         elif buttonvalue == 'Submit':
             # groupname, total (time), turn (time) being added to groups
             # don't allow if groupname already being used
             groups = DATA['groups']
             group = postdict['groupname'] = sanitize(postdict['groupname'])
-            if not group in groups:
-                groups[group] = postdict
-                groups[group]['participants'] = {}
-                return cookie, copy.deepcopy(DATA)
-            else:
-                raise ValueError((
-                    'Group {group[groupname]} already exists with total time '
-                    '{group[total]} minutes and turn time '
-                    '{group[turn]} seconds').format(group=groups[group]))
+            with grouplock(group):
+                with LOCK:
+                    exists = group in groups
+                    if not exists:
+                        groups[group] = dict(postdict)
+                        groups[group]['participants'] = {}
+                if exists:
+                    raise ValueError((
+                        'Group {group[groupname]} already exists with total '
+                        'time {group[total]} minutes and turn time '
+                        '{group[turn]} seconds').format(group=groups[group]))
+                publish(group, event='create')
         elif buttonvalue == 'OK':
             # affirming receipt of error message or Help screen
-            return cookie, copy.deepcopy(DATA)
+            pass
         elif buttonvalue == 'Help':
             raise UserWarning('Help requested')
         elif buttonvalue == 'My Turn':
             # attempting to speak in ongoing session
             # this can be reached either by normal HTML form submission
             # or by XHR from JavaScript on client side
-            debug('button', 'My Turn button pressed, env: %s', env)
+            debug('button', 'My Turn button pressed: %s', postdict)
             groups = DATA['groups']
             group = sanitize(postdict['groupname'])
             username = postdict['username']
             try:
-                userdata = groups[group]['participants'][username]
-                if not userdata['request']:
-                    debug('button', "userdata: setting %s's request to %.6f",
-                          username, timestamp)
-                    userdata['request'] = timestamp
-                    userdata['requests'].append([timestamp, None])
-                else:
-                    logging.warning('ignoring newer request %.6f, '
-                                    'keeping %.6f', userdata['request'],
-                                    timestamp)
+                if group not in groups:  # don't make a lock for it
+                    raise KeyError(group)
+                with grouplock(group):
+                    userdata = groups[group]['participants'][username]
+                    if not userdata['request']:
+                        debug('button', "userdata: setting %s's request "
+                              "to %.6f", username, timestamp)
+                        userdata['request'] = timestamp
+                        userdata['requests'].append([timestamp, None])
+                        enqueue(group, username)
+                        select_speaker(group)  # in case nobody is speaking
+                        publish(group, event='request')
+                    else:
+                        logging.warning('ignoring newer request %.6f, '
+                                        'keeping %.6f', userdata['request'],
+                                        timestamp)
             except KeyError:
                 raise SystemError('Group %s is no longer active' % group)
-            return cookie, copy.deepcopy(DATA)
         elif buttonvalue == 'Cancel request':
             debug('button', 'My Turn button released')
             groups = DATA['groups']
             group = sanitize(postdict['groupname'])
             username = postdict['username']
             try:
-                userdata = groups[group]['participants'][username]
-                if userdata['request']:
-                    userdata['request'] = None
-                    userdata['requests'][-1][1] = timestamp
-                else:
-                    logging.error('no speaking request found for %s', username)
+                if group not in groups:  # don't make a lock for it
+                    raise KeyError(group)
+                with grouplock(group):
+                    userdata = groups[group]['participants'][username]
+                    if userdata['request']:
+                        userdata['request'] = None
+                        userdata['requests'][-1][1] = timestamp
+                        click(group, username, userdata['requests'][-1])
+                        select_speaker(group)  # in case it was the speaker
+                        publish(group, event='cancel')
+                    else:
+                        logging.error('no speaking request found for %s',
+                                      username)
             except KeyError:
                 raise SystemError('Group %s is no longer active' % group)
-            return cookie, copy.deepcopy(DATA)
         elif buttonvalue == 'Check status':
-            return cookie, copy.deepcopy(DATA)
+            pass
         else:
             raise ValueError('Unknown form submitted')
     except UserWarning as request:
         if str(request) == 'Help requested':
             debug('all', 'displaying help screen')
-            DATA['postdict']['text'] = read(os.path.join(THISDIR, 'README.md'))
-            return cookie, copy.deepcopy(DATA)
+            postdict['text'] = read(os.path.join(THISDIR, 'README.md'))
     except EXPECTED_ERRORS as failed:
         debug('all', 'displaying error: "%r"', failed)
-        DATA['postdict']['text'] = repr(failed)
-        return cookie, copy.deepcopy(DATA)
-    finally:
-        uwsgi.unlock()
+        postdict['text'] = repr(failed)
+    return cookie, postdict
+
+@contextlib.contextmanager
+def grouplock(group):
+    '''
+    hold the lock guarding everything within one group
+
+    press of a button in one group never waits on any other group. the
+    lock outlives the group until `evict` drops it from memory; anyone who
+    was waiting for it then tries again with the group's new lock, so two
+    threads can never hold different locks for the same group.
+
+    >>> with grouplock('test'):
+    ...     'test' in GROUPLOCKS
+    True
+    '''
+    while True:
+        try:
+            lock = GROUPLOCKS[group]
+        except KeyError:
+            with LOCK:
+                lock = GROUPLOCKS.setdefault(group, MeteredLock('group')
+                                             if METRICS else threading.Lock())
+        with lock:
+            if GROUPLOCKS.get(group) is lock:
+                yield
+                return
+
+def publish(group, data=None, event='change'):
+    '''
+    make a new read-only version of DATA available to readers
+
+    only `group` is copied, every other group, active or finished, is shared
+    with the previous version. so the cost doesn't grow with the number of
+    groups ever held. caller must hold the group's lock.
+
+    the copy is also what goes into the JOURNAL, as `event`, unless
+    `event` is None.
+
+    >>> DATA['groups']['test'] = {'participants': {'jc': {'spoke': 0}}}
+    >>> publish('test', event=None)  # not to be journaled
+    >>> snapshot()['groups']['test'] == DATA['groups']['test']
+    True
+    >>> snapshot()['groups']['test'] is DATA['groups']['test']
+    False
+    >>> DATA['finished']['test'] = DATA['groups'].pop('test')
+    >>> publish('test', event=None)
+    >>> 'test' in snapshot()['groups'], 'test' in snapshot()['finished']
+    (False, True)
+    >>> del DATA['finished']['test']
+    >>> publish('test', event=None)
+    >>> 'test' in snapshot()['finished']
+    False
+    '''
+    global SNAPSHOT  # pylint: disable=global-statement
+    data = data or DATA
+    if data is not DATA:
+        return  # doctests and the like, nobody is reading from these
+    # the slow part, copying the group, needs only the group's lock
+    began = time.perf_counter()
+    copies = {key: copy.deepcopy(data[key][group])
+              for key in ('groups', 'finished') if group in data[key]}
+    observe('serialize_seconds', time.perf_counter() - began, 'copy')
+    with LOCK:
+        previous = SNAPSHOT
+        version = {'version': previous['version'] + 1}
+        for key in ('groups', 'finished'):
+            shared = previous[key]
+            if key in copies:
+                version[key] = dict(shared)
+                version[key][group] = copies[key]
+            elif group in shared:
+                version[key] = {k: v for k, v in shared.items() if k != group}
+            else:
+                version[key] = shared
+        version['mutations'] = {k: previous['mutations'][k]
+                                for k in version['groups'] if k != group}
+        if group in version['groups']:
+            version['mutations'][group] = version['version']
+        else:
+            GROUPCACHE.pop(group, None)
+            TALKCACHE.pop(group, None)
+        version['finishes'] = {k: previous['finishes'][k]
+                               for k in version['finished'] if k != group}
+        if group in version['finished']:
+            version['finishes'][group] = version['version']
+        SNAPSHOT = version  # readers see the old or the new, never a mix
+        if event is not None:
+            journal(event, group, copies)
+    if LISTENERS.get(group):
+        etag, payload = talksession_json(group, version)
+        announce(group, 'group' if etag else 'finished', payload)
+
+def snapshot(**request):
+    '''
+    cheap read-only view of the latest published version of DATA
+
+    request-specific items like `postdict` go into the (new) top-level dict,
+    everything below that is shared between requests and must not be
+    modified.
+
+    >>> view = snapshot(postdict={'submit': 'OK'})
+    >>> view['postdict'], view['groups'] is snapshot()['groups']
+    ({'submit': 'OK'}, True)
+    '''
+    view = dict(BACKEND.snapshot())
+    view.update(request)
+    return view
+
+class LocalState():
+    '''
+    DATA and HTTPSESSIONS kept right here in this process, the default
+
+    also what a `stateserver` serves to its `SharedState` clients.
+    '''
+    @staticmethod
+    def apply(postdict, cookie=None):
+        '''
+        make the change a form submission asks for, see `apply`
+        '''
+        return apply(postdict, cookie)
+
+    @staticmethod
+    def snapshot():
+        '''
+        latest published version of DATA
+        '''
+        return SNAPSHOT
+
+    @staticmethod
+    def archived(group):
+        '''
+        finished group from ARCHIVE, or None, see `archived`
+        '''
+        return archived(group)
+
+    @staticmethod
+    def sessions():
+        '''
+        counts of http sessions live, and dropped so far
+        '''
+        with SESSIONLOCK:
+            return dict(SESSIONCOUNTS, live=len(HTTPSESSIONS))
+
+    @staticmethod
+    def changes(version, instance=None):
+        '''
+        what changed since `version`, for a `SharedState` to catch up
+
+        groups that haven't changed are sent as None.
+
+        >>> LocalState.changes(snapshot()['version'], INSTANCE)[2] is None
+        True
+        >>> sorted(LocalState.changes(snapshot()['version'])[2])
+        ['finished', 'finishes', 'groups', 'mutations', 'version']
+        '''
+        current = SNAPSHOT
+        if instance != INSTANCE:
+            version = -1  # a different server, or this one restarted
+        if current['version'] == version:
+            return INSTANCE, time.monotonic(), None
+        changed = {'version': current['version'],
+                   'mutations': current['mutations'],
+                   'finishes': current['finishes']}
+        for key, versions in (('groups', 'mutations'),
+                              ('finished', 'finishes')):
+            changed[key] = {
+                group: groupdata if current[versions][group] > version
+                       else None
+                for group, groupdata in current[key].items()}
+        return INSTANCE, time.monotonic(), changed
+
+class SharedState():
+    '''
+    DATA and HTTPSESSIONS kept by a `stateserver`, shared by many processes
+
+    every process using the same server sees the same meetings, so uwsgi
+    can run as many processes, on as many machines, as it needs. changes
+    are made by the server; reads are served from a copy of its snapshot,
+    brought up to date no more than every FRESHNESS seconds.
+    '''
+    def __init__(self, address):
+        self.address = address
+        self.server = None  # connected lazily, the server may start later
+        self.lock = threading.Lock()  # one thread at a time catches up
+        self.view = {'version': 0, 'groups': {}, 'finished': {},
+                     'mutations': {}, 'finishes': {}}
+        self.instance = self.delay = None
+        self.fetched = self.offset = 0
+
+    def call(self, method, *args):
+        '''
+        call method of the server's LocalState, reconnecting as needed
+        '''
+        if self.server is None:
+            address, authkey = stateaddress(self.address)
+            manager = StateManager(address, authkey=authkey)
+            manager.connect()
+            self.server = manager.state()
+        try:
+            return getattr(self.server, method)(*args)
+        except (OSError, EOFError):
+            self.server = None
+            raise
+
+    def sessions(self):
+        '''
+        counts of http sessions, as kept by the server
+        '''
+        return self.call('sessions')
+
+    def archived(self, group):
+        '''
+        finished group from the server's ARCHIVE, or None
+        '''
+        return self.call('archived', group)
+
+    def apply(self, postdict, cookie=None):
+        '''
+        have the server make the change, and see it on the next read
+        '''
+        result = self.call('apply', postdict, cookie)
+        self.fetched = -FRESHNESS
+        return result
+
+    def snapshot(self):
+        '''
+        copy of the server's latest version of DATA, no older than FRESHNESS
+        '''
+        if time.monotonic() - self.fetched >= FRESHNESS:
+            with self.lock:
+                if time.monotonic() - self.fetched >= FRESHNESS:
+                    self.catch_up()
+        return self.view
+
+    def catch_up(self):
+        '''
+        fetch whatever changed on the server since the last time
+        '''
+        sent = time.monotonic()
+        instance, now, changed = self.call('changes', self.view['version'],
+                                           self.instance)
+        received = time.monotonic()
+        # clocks are translated using the quickest round trip seen so far
+        if instance != self.instance or received - sent < self.delay:
+            self.delay = received - sent
+            self.offset = (sent + received) / 2 - now
+        if instance != self.instance:  # the server restarted, and its
+            GROUPCACHE.clear()  # count of versions with it
+            TALKCACHE.clear()
+        self.instance, self.fetched = instance, received
+        if changed is None:
+            return
+        view = {key: changed[key]
+                for key in ('version', 'mutations', 'finishes')}
+        view['instance'] = instance  # for `version_tag`
+        view['groups'] = {
+            group: self.view['groups'][group] if groupdata is None
+                   else translate(groupdata, self.offset)
+            for group, groupdata in changed['groups'].items()}
+        view['finished'] = {
+            group: self.view['finished'][group] if groupdata is None
+                   else groupdata
+            for group, groupdata in changed['finished'].items()}
+        for group, groupdata in changed['finished'].items():
+            if groupdata is not None:
+                REPORTS[group] = render_report(groupdata)
+        for group in set(self.view['finished']) - set(view['finished']):
+            REPORTS.pop(group, None)  # evicted by the server
+        for group in set(self.view['groups']) - set(view['groups']):
+            GROUPCACHE.pop(group, None)  # as `publish` does on the server
+            TALKCACHE.pop(group, None)
+        self.view = view
+
+class StateManager(BaseManager):
+    '''
+    connection between `stateserver` and `SharedState`
+    '''
+StateManager.register('state', LocalState)
+
+def stateserver(address):
+    '''
+    keep DATA and HTTPSESSIONS for all processes with STATE set, forever
+
+    `myturn.py state /tmp/pyturn-state.sock`, or host:port (with a
+    state-key) to serve other machines. each connection is served by a
+    thread of its own, taking the same locks uwsgi threads would.
+    '''
+    address, authkey = stateaddress(address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)  # left over from before a restart
+    server = StateManager(address, authkey=authkey).get_server()
+    logging.info('state server listening on %s', server.address)
+    server.serve_forever()
+
+def stateaddress(address):
+    '''
+    StateManager address and key from host:port or unix socket path
+
+    pickles from a state server are trusted, so it must never be reachable
+    over the network without a key of its own.
+
+    >>> stateaddress('/tmp/pyturn-state.sock')
+    ('/tmp/pyturn-state.sock', b'myturn')
+    '''
+    if ':' in address:
+        if not STATEKEY:
+            raise ValueError('state-key must be set for TCP state server')
+        host, port = address.rsplit(':', 1)
+        return (host, int(port)), STATEKEY
+    return address, STATEKEY or b'myturn'
+
+def translate(groupdata, offset):
+    '''
+    copy of group with its talksession clock moved by `offset` seconds
+
+    time.monotonic() means nothing on another machine, or even in another
+    process on some systems, so times from a state server are moved onto
+    this process's clock.
+
+    >>> translate({'talksession': {'clock': 1.0, 'ending': 61.0,
+    ...  'since': None, 'start': 5}}, 10)['talksession']
+    {'clock': 11.0, 'ending': 71.0, 'since': None, 'start': 5}
+    '''
+    talksession = groupdata.get('talksession')
+    if not offset or talksession is None:
+        return groupdata
+    view = dict(groupdata)
+    view['talksession'] = dict(talksession)
+    for key in ('clock', 'ending', 'since'):
+        if view['talksession'].get(key) is not None:
+            view['talksession'][key] += offset
+    return view
+
+def group_json(group, data):
+    '''
+    encoded JSON of an active group, and its ETag
+
+    the encoding is done only once per change to the group, no matter how
+    many participants are polling it. the cache key, `tick` plus the version
+    in which the group last changed, is unique even if a group of the same
+    name is created again later.
+
+    >>> data = {'groups': {'test': {'talksession': {
+    ...  'speaker': None, 'clock': 0, 'ending': .75}}},
+    ...         'mutations': {'test': 22}}
+    >>> group_json('test', data)[0]  # doctest: +ELLIPSIS
+    '"3-22-..."'
+    >>> json.loads(group_json('test', data)[1].decode())['talksession']
+    {'speaker': None, 'clock': 0, 'ending': 0.75, 'remaining': 0, 'tick': 3}
+    >>> group_json('test', data)[1] is GROUPCACHE['test'][2]
+    True
+    >>> group_json('none', data)
+    (None, b'{}')
+    '''
+    try:
+        groupdata = data['groups'][group]
+    except KeyError:
+        debug('all', 'group %s does not exist', group)
+        return None, b'{}'
+    now = time.monotonic()
+    key = (ticks(groupdata.get('talksession'), now), data['mutations'][group])
+    cached = GROUPCACHE.get(group)
+    if cached is None or cached[0] != key:
+        began = time.perf_counter()
+        cached = (key, '"%s"' % version_tag(key, data),
+                  json.dumps(elapsed(groupdata, now)).encode('utf8'))
+        GROUPCACHE[group] = cached
+        observe('serialize_seconds', time.perf_counter() - began, 'group')
+    return cached[1:]
+
+def version_tag(key, data):
+    '''
+    the version a group's JSON is as of, for clients and ETags
+
+    that is the tick and the version the group last changed in, from
+    `key`, and which start of the server counted that version, since the
+    count starts over from nothing on every restart.
+
+    >>> version_tag((3, 22), {'instance': '0123456789abcdef'})
+    '3-22-01234567'
+    '''
+    return '%d-%d-%s' % (key + (data.get('instance', INSTANCE)[:8],))
+
+def talksession_json(group, data, since=None):
+    '''
+    encoded JSON of just what the talksession page shows, and its ETag
+
+    that is the speaker, how long they've been speaking, the time
+    remaining, and who is waiting to speak, with the `version` it is as of.
+    given the version a client last saw as `since`, and nothing but the
+    clock has changed since then, only the clock values are sent. like
+    `group_json`, each is encoded only once per change.
+
+    >>> data = {'groups': {'test': {'groupname': 'test', 'participants': {
+    ...  'jc': {'request': 5.0}, 'ed': {}}, 'talksession': {
+    ...  'speaker': 'ed', 'since': 0, 'clock': 0, 'ending': .75}}},
+    ...         'mutations': {'test': 22}, 'instance': 'feedface'}
+    >>> etag, page = talksession_json('test', data)
+    >>> etag, json.loads(page.decode())
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ('"3-22-feedface"', {'groupname': 'test', 'version': '3-22-feedface',
+     'tick': 3, 'remaining': 0, 'speaker': 'ed', 'speaking': 0.75,
+     'participants': ['ed', 'jc'], 'waiting': ['jc']})
+    >>> talksession_json('test', data, since='1-22-feedface')[1]
+    ... # doctest: +NORMALIZE_WHITESPACE
+    b'{"version": "3-22-feedface", "tick": 3, "remaining": 0,
+     "speaking": 0.75}'
+    >>> talksession_json('test', data, since='3-21-feedface')[1] == page
+    True
+    >>> talksession_json('test', data, since='3-22-deadbeef')[1] == page
+    True
+    >>> talksession_json('none', data)
+    (None, b'{}')
+    '''
+    try:
+        groupdata = data['groups'][group]
+    except KeyError:
+        debug('all', 'group %s does not exist', group)
+        return None, b'{}'
+    now = time.monotonic()
+    key = (ticks(groupdata.get('talksession'), now), data['mutations'][group])
+    cached = TALKCACHE.get(group)
+    if cached is None or cached[0] != key:
+        began = time.perf_counter()
+        view = elapsed(groupdata, now)
+        talksession = view.get('talksession', {})
+        speaker = talksession.get('speaker')
+        clock = {
+            'version': version_tag(key, data),
+            'tick': talksession.get('tick', 0),
+            'remaining': talksession.get('remaining', 0),
+            'speaking': view['participants'][speaker].get('speaking', 0)
+                        if speaker else None,
+        }
+        projection = {
+            'groupname': groupdata.get('groupname', group),
+            'version': clock['version'],
+            'tick': clock['tick'],
+            'remaining': clock['remaining'],
+            'speaker': speaker,
+            'speaking': clock['speaking'],
+            'participants': sorted(groupdata['participants']),
+            'waiting': sorted(name for name, userdata
+                              in groupdata['participants'].items()
+                              if userdata.get('request')),
+        }
+        cached = (key, clock['version'],
+                  json.dumps(projection).encode('utf8'),
+                  json.dumps(clock).encode('utf8'),
+                  projection['participants'].index(speaker) if speaker
+                  else -1)  # for `heartbeat`
+        TALKCACHE[group] = cached
+        observe('serialize_seconds', time.perf_counter() - began,
+                'talksession')
+    if since and since.partition('-')[2] == cached[1].partition('-')[2]:
+        return '"%s"' % cached[1], cached[3]
+    return '"%s"' % cached[1], cached[2]
+
+def heartbeat(group, data, username=None, since=None):
+    '''
+    the talksession poll as HEARTBEAT, 24 bytes instead of JSON
+
+    the speaker is given by index into the talksession's `participants`,
+    which only change when the version does, so the index is found along
+    with the JSON in TALKCACHE rather than for every poll. flags are
+    QUANTUM if the speaker's turn started after tick `since`, REQUESTING
+    if `username` is waiting to speak, and ENDED if the group is no longer
+    active.
+
+    >>> data = {'groups': {'test': {'participants': {
+    ...  'jc': {'request': 5.0}, 'ed': {}}, 'talksession': {
+    ...  'speaker': 'ed', 'since': 0.5, 'clock': 0, 'ending': .75}}},
+    ...         'mutations': {'test': 22}, 'instance': 'feedface'}
+    >>> HEARTBEAT.unpack(heartbeat('test', data, 'jc', 1))
+    (1, 3, 0, 22, 4277009102, 3, 0.0, 0.25)
+    >>> HEARTBEAT.unpack(heartbeat('test', data, 'ed', 2))
+    (1, 0, 0, 22, 4277009102, 3, 0.0, 0.25)
+    >>> HEARTBEAT.unpack(heartbeat('none', data))
+    (1, 4, -1, 0, 0, 0, 0.0, 0.0)
+    '''
+    try:
+        groupdata = data['groups'][group]
+    except KeyError:
+        return HEARTBEAT.pack(1, ENDED, -1, 0, 0, 0, 0, 0)
+    now = time.monotonic()
+    talksession = groupdata.get('talksession') or {}
+    participants = groupdata['participants']
+    key = (ticks(talksession, now), data['mutations'][group])
+    cached = TALKCACHE.get(group)
+    if cached is None or cached[0][1] != key[1]:
+        talksession_json(group, data)
+        cached = TALKCACHE.get(group, cached)  # unless it just finished
+    index = cached[4] if cached else -1
+    flags, remaining, speaking = 0, 0, 0
+    if 'clock' in talksession:
+        remaining = max(0, talksession['ending'] - now)
+        if talksession['speaker']:
+            speaking = min(now, talksession['ending']) - talksession['since']
+            if since is not None and (talksession['since'] >
+                                      talksession['clock'] + since * TICK):
+                flags |= QUANTUM
+    if participants.get(username, {}).get('request'):
+        flags |= REQUESTING
+    instance = int(version_tag(key, data).rpartition('-')[2], 16)
+    return HEARTBEAT.pack(1, flags, index, key[1], instance, key[0],
+                          remaining, speaking)
+
+def ticks(talksession, now):
+    '''
+    number of TICKs a talksession has been running as of `now`
+
+    >>> ticks({'clock': 10.0, 'ending': 20.0}, 11.1), ticks(None, 11.1)
+    (4, 0)
+    '''
+    if talksession is None or 'clock' not in talksession:
+        return 0  # nobody has joined yet
+    return int((min(now, talksession['ending']) - talksession['clock']) / TICK)
+
+def elapsed(groupdata, now=None):
+    '''
+    copy of a group with its clock-derived values worked out as of `now`
+
+    `remaining`, `tick`, and the current speaker's `speaking` and `spoke`
+    are only stored when something happens, not as time passes, so they
+    have to be computed when read. the group itself is not modified.
+
+    >>> group = {'participants': {'jc': {'spoke': 10.0}}, 'talksession': {
+    ...  'speaker': 'jc', 'since': 95.0, 'clock': 40.0, 'ending': 100.0}}
+    >>> view = elapsed(group, 97.5)
+    >>> view['participants']['jc'], view['talksession']['remaining']
+    ({'spoke': 12.5, 'speaking': 2.5}, 2.5)
+    >>> view['talksession']['tick'], group['participants']['jc']['spoke']
+    (230, 10.0)
+    '''
+    now = time.monotonic() if now is None else now
+    talksession = groupdata.get('talksession')
+    if talksession is None or 'clock' not in talksession:
+        return groupdata
+    view = dict(groupdata)
+    view['talksession'] = dict(talksession,
+                               remaining=max(0, talksession['ending'] - now),
+                               tick=ticks(talksession, now))
+    speaker = talksession['speaker']
+    if speaker:
+        speaking = min(now, talksession['ending']) - talksession['since']
+        view['participants'] = dict(groupdata['participants'])
+        userdata = dict(groupdata['participants'][speaker])
+        userdata['spoke'] = userdata.get('spoke', 0) + speaking
+        userdata['speaking'] = speaking
+        view['participants'][speaker] = userdata
+    return view
 
 def most_eligible_speaker(group, data=None):
     '''
@@ -603,34 +1991,95 @@ def most_eligible_speaker(group, data=None):
     data = data or DATA
     groupdata = data['groups'][group]
     people = groupdata['participants']
-    waiting = filter(lambda p: people[p]['request'], people)
-    speaker_pool = sorted(waiting, key=lambda p:
-                          (people[p]['spoke'], people[p]['request']))
-    return (speaker_pool or [None])[0]
+    if data is DATA and group in QUEUES:
+        queue = QUEUES[group]
+    else:  # snapshots and such have no queue, so build one
+        # using .get() so as not to add keys to a snapshot's defaultdicts
+        queue = [(people[p].get('spoke', 0), people[p]['request'], p)
+                 for p in people if people[p].get('request')]
+        heapq.heapify(queue)
+    while queue and not queued(queue[0], people):
+        heapq.heappop(queue)
+    return queue[0][2] if queue else None
+
+def enqueue(group, username, data=None):
+    '''
+    add participant's request to the group's heap of waiting speakers
+
+    must be called again whenever the participant's `request` or `spoke`
+    changes while he is still waiting. old entries are not searched for and
+    removed: they simply go stale, and are dropped by most_eligible_speaker
+    when they reach the top, or when the heap gets too big.
 
-def select_speaker(group, data=None):
+    >>> DATA['groups']['test'] = {'participants': {
+    ...  'alice': {'spoke': 3, 'request': 1.0},
+    ...  'bob': {'spoke': 2, 'request': 2.0}}}
+    >>> enqueue('test', 'alice'), enqueue('test', 'bob')
+    (None, None)
+    >>> most_eligible_speaker('test')
+    'bob'
+    >>> DATA['groups']['test']['participants']['bob']['request'] = None
+    >>> most_eligible_speaker('test')
+    'alice'
+    >>> del DATA['groups']['test'], QUEUES['test']
+    '''
+    data = data or DATA
+    if data is not DATA:
+        return  # nothing but DATA gets a queue
+    people = data['groups'][group]['participants']
+    userdata = people[username]
+    queue = QUEUES.setdefault(group, [])
+    heapq.heappush(queue, (userdata['spoke'], userdata['request'], username))
+    if len(queue) > 2 * len(people) + 16:
+        queue[:] = [entry for entry in queue if queued(entry, people)]
+        heapq.heapify(queue)
+
+def queued(entry, people):
+    '''
+    check that a heap entry still matches the participant's state
+    '''
+    userdata = people.get(entry[2])
+    return (userdata is not None and userdata.get('request') == entry[1] and
+            userdata.get('spoke', 0) == entry[0])
+
+def select_speaker(group, data=None, expired=False, now=None):
     '''
     let current speaker finish his turn before considering most eligible
 
     SIDE EFFECTS:
-        when `turn` time is up or speaker voluntarily relinquishes turn:
-            sets speaker's `speaking` count to zero in data dict
-            sets speaker to new speaker
+        when `turn` time is up (`expired`) or speaker voluntarily
+        relinquishes turn:
+            adds the time he spoke to the speaker's `spoke` total
+            sets speaker to new speaker, whose turn starts `now`
+            notes when the new speaker's request was first granted
+            schedules the end of the new turn
 
-    NOTE: not using uwsgi.lock for this, shouldn't be necessary. no
-    possible race conditions are known at time of coding (jc).
+    NOTE: modifies the group in place, so caller must hold the group's lock,
+    and must never pass it a snapshot.
     '''
     data = data or DATA
+    now = time.monotonic() if now is None else now
     groupdata = data['groups'][group]
     talksession = groupdata['talksession']
-    turntime = float(groupdata['turn'])
     if talksession['speaker']:
         speaker = groupdata['participants'][talksession['speaker']]
-        if speaker['speaking'] >= turntime or not speaker['request']:
-            speaker['speaking'] = 0
-            talksession['speaker'] = most_eligible_speaker(group, data)
+        if speaker['request'] and not expired:
+            return talksession['speaker']
+        speaker['spoke'] += now - talksession['since']
+        talksession['turns'] += 1  # any pending `turn_over` is now stale
+        if speaker['request']:
+            enqueue(group, talksession['speaker'], data)  # at his new `spoke`
+    talksession['speaker'] = most_eligible_speaker(group, data)
+    if talksession['speaker']:
+        talksession['since'] = now
+        requests = groupdata['participants'][talksession['speaker']].get(
+            'requests')
+        if requests and len(requests[-1]) == 2:  # first turn for the request
+            requests[-1].append(now + time.time() - time.monotonic())
+        schedule(now + float(groupdata['turn']), turn_over, group, data,
+                 (talksession['start'], talksession['turns']))
     else:
-        talksession['speaker'] = most_eligible_speaker(group, data)
+        talksession['since'] = None
     return talksession['speaker']
 
 def sanitize(name):
@@ -648,12 +2097,64 @@ def sanitize(name):
     '''
     return name.translate(ILLEGAL).lstrip('-.') if name is not None else None
 
+def schedule(deadline, function, *args):
+    '''
+    call function(*args) in the scheduler thread at `deadline`
+
+    `deadline` is in time.monotonic() seconds. a single thread serves
+    every talksession, sleeping until the earliest deadline comes due,
+    so the thread count stays the same however many meetings are running.
+
+    >>> done = threading.Event()
+    >>> schedule(time.monotonic() + .01, done.set)
+    >>> done.wait(5)
+    True
+    '''
+    timer = [deadline, next(SEQUENCE), function, args]
+    with TIMER:
+        heapq.heappush(TIMERS, timer)
+        if not SCHEDULER or SCHEDULER[1] != os.getpid():
+            # not started yet, or started before this process was forked
+            SCHEDULER[:] = [threading.Thread(target=scheduler,
+                                             name='scheduler'), os.getpid()]
+            SCHEDULER[0].daemon = True  # leave no zombies on exit
+            SCHEDULER[0].start()
+        elif TIMERS[0] is timer:
+            TIMER.notify()  # new earliest deadline, scheduler must wake early
+
+def scheduler():
+    '''
+    run scheduled functions as they come due, forever
+    '''
+    thread = threading.current_thread()
+    while True:
+        with TIMER:
+            while True:
+                now = time.monotonic()
+                if TIMERS and TIMERS[0][0] <= now:
+                    break
+                TIMER.wait(TIMERS[0][0] - now if TIMERS else None)
+            deadline, _, function, args = heapq.heappop(TIMERS)
+        # so a profile shows which group the time was spent on
+        thread.name = 'scheduler %s' % args[0] if args else 'scheduler'
+        began = time.perf_counter()
+        observe('timer_lateness_seconds', time.monotonic() - deadline,
+                function.__name__)
+        try:
+            function(*args)
+        except Exception:  # pylint: disable=broad-except
+            logging.error('scheduler: %s%r failed', function.__name__, args,
+                          exc_info=True)
+        observe('timer_run_seconds', time.perf_counter() - began,
+                function.__name__)
+
 def countdown(group, data=None):
     '''
-    expire the talksession after `minutes`
+    start the clock on a talksession, to expire it after `total` minutes
 
-    currently only using uwsgi.lock() when moving group to `finished`.
-    may need to reevaluate that (jc).
+    only sets things up. from then on, the scheduler thread wakes up for
+    this group only when a turn, or the talksession itself, is over.
+    caller must hold the group's lock.
 
     >>> now = datetime.datetime.utcnow().timestamp()
     >>> data = {'finished': {}, 'groups': {
@@ -663,54 +2164,375 @@ def countdown(group, data=None):
     ...          'participants': {'nobody': {'requests': [[0.1, 0.2]]}},
     ...         }}}
     >>> countdown('test', data)
+    >>> time.sleep(1)
+    >>> list(data['finished'])
+    ['test']
     '''
     data = data or DATA
-    groups = data['groups']
-    sleeptime = .25  # seconds
-    try:
-        minutes = float(groups[group]['total'])
-        groups[group]['talksession']['remaining'] = minutes * 60
-        ending = (datetime.datetime.fromtimestamp(
-            groups[group]['talksession']['start']) +
-                  datetime.timedelta(minutes=minutes)).timestamp()
-        debug('countdown', 'countdown ending: %.6f', ending)
-        while True:
-            time.sleep(sleeptime)
-            now = datetime.datetime.utcnow().timestamp()
-            debug('countdown', 'countdown now: %.6f', now)
-            if now > ending:
-                debug('countdown', 'countdown ended at %.6f', now)
-                break
-            speaker = select_speaker(group, data)
-            debug('countdown', 'countdown: speaker: %s', speaker)
-            if speaker:
-                speakerdata = groups[group]['participants'][speaker]
-                speakerdata['speaking'] += sleeptime
-                speakerdata['spoke'] += sleeptime
-            groups[group]['talksession']['remaining'] -= sleeptime
-            groups[group]['talksession']['tick'] += 1
-        # should we uwsgi.lock() here in case group is currently being updated?
-        # if so, need uwsgi.unlock() in `finally` clause
-        data['finished'][group] = data['groups'].pop(group)
-        # now save the report of clicks, not same as report of time spoken
-        reportdir = os.path.join('statistics', group)
-        reportname = os.path.join(reportdir, '%.6f.json' % now)
+    talksession = data['groups'][group]['talksession']
+    minutes = float(data['groups'][group]['total'])
+    talksession['clock'] = time.monotonic()
+    talksession['ending'] = talksession['clock'] + minutes * 60
+    talksession['since'] = None  # start of current speaker's turn
+    talksession['turns'] = 0  # so stale `turn_over` calls can be ignored
+    debug('countdown', 'countdown ending: %.6f', talksession['ending'])
+    schedule(talksession['ending'], finish, group, data)
+
+def turn_over(group, data, turn):
+    '''
+    end a speaker's turn, unless it already ended some other way
+    '''
+    if group not in data['groups']:  # don't make a lock for it
+        debug('countdown', 'turn_over: group %s already finished', group)
+        return
+    with grouplock(group):
         try:
-            participants = data['finished'][group]['participants']
+            talksession = data['groups'][group]['talksession']
         except KeyError:
-            logging.error("No such key 'participants' in %s",
-                          data['finished'][group])
+            debug('countdown', 'turn_over: group %s already finished', group)
             return
-        os.makedirs(reportdir, exist_ok=True)
-        report = open(reportname, 'w')
-        report.write(json.dumps([{speaker: participants[speaker]['requests']}
-                                 for speaker in participants],
-                                indent=4))
-        report.close()
-    except KeyError as error:
-        logging.error('countdown: was group "%s" removed? KeyError: %s',
-                      group, error, exc_info=True)
-        logging.info('data: %s', data)
+        if (talksession['start'], talksession['turns']) == turn:
+            select_speaker(group, data, expired=True)
+            publish(group, data, event='turn')
+
+def finish(group, data):
+    '''
+    move expired group to `finished` and finish its file of clicks
+    '''
+    now = datetime.datetime.utcnow().timestamp()
+    debug('countdown', 'countdown ended at %.6f', now)
+    with grouplock(group):
+        with LOCK:
+            data['finished'].pop(group, None)  # so it's last to be evicted
+            groupdata = data['finished'][group] = data['groups'].pop(group)
+        QUEUES.pop(group, None)
+        talksession = groupdata['talksession']
+        if talksession['speaker']:
+            speaker = groupdata['participants'][talksession['speaker']]
+            speaker['spoke'] += max(0, talksession['ending'] -
+                                    talksession['since'])
+            talksession['speaker'] = None
+        if data is DATA:
+            # every participant's client asks for the report at once
+            REPORTS[group] = render_report(groupdata)
+            # requests still open at the end were never cancelled
+            for username, userdata in groupdata['participants'].items():
+                for interval in userdata['requests']:
+                    if interval[1] is None:
+                        click(group, username, interval)
+            click(group)
+        publish(group, data, event='finish')
+    if data is DATA:
+        with LOCK:
+            later('archive', (group, groupdata))
+
+def click(group, username=None, interval=None):
+    '''
+    queue a participant's request to speak, as a line of the group's file
+    of clicks, for `commit` to write; with no `username`, finish the file
+
+    the file, statistics/<group>/<start>.jsonl, has a line for each
+    request: when it was made, first granted, and cancelled, each null
+    if it never was. it is written as the talksession goes on, as
+    `<file>.part`, and renamed when it finishes. caller must hold the
+    group's lock.
+    '''
+    groupdata = DATA['groups'].get(group, DATA['finished'].get(group))
+    path = os.path.join('statistics', group,
+                        '%.6f.jsonl' % groupdata['talksession']['start'])
+    line = None if username is None else json.dumps(
+        {'user': username, 'requested': interval[0],
+         'granted': interval[2] if len(interval) > 2 else None,
+         'cancelled': interval[1]}, separators=(',', ':')) + '\n'
+    with LOCK:
+        later('clicks', (path, line))
+
+def summarize(records):
+    '''
+    totals for each user over (file, record) pairs from `clicks`
+
+    >>> summarize([('a', {'user': 'jc', 'requested': 1, 'cancelled': 3}),
+    ...            ('a', {'user': 'jc', 'requested': 5, 'cancelled': None}),
+    ...            ('b', {'user': 'jc', 'requested': 2, 'cancelled': 3})])
+    {'jc': {'meetings': 2, 'requests': 3, 'cancelled': 2, 'seconds': 3}}
+    '''
+    totals, last = {}, {}
+    for path, record in records:
+        user = totals.setdefault(record['user'], {
+            'meetings': 0, 'requests': 0, 'cancelled': 0, 'seconds': 0})
+        if last.get(record['user']) != path:  # files are read one by one
+            last[record['user']] = path
+            user['meetings'] += 1
+        user['requests'] += 1
+        if record['cancelled'] is not None:
+            user['cancelled'] += 1
+            user['seconds'] += record['cancelled'] - record['requested']
+    return totals
+
+def journal(event, group, copies):
+    '''
+    queue a change to a group for the next `commit`
+
+    times are stored as time.time(), monotonic time being meaningless in
+    another process. caller must hold LOCK, which keeps the JOURNAL in
+    the same order as the versions of SNAPSHOT.
+    '''
+    record = {'event': event, 'group': group, 'time': time.time()}
+    if 'groups' in copies:
+        record['data'] = translate(copies['groups'],
+                                   record['time'] - time.monotonic())
+    if event == 'finish':
+        record['finished'] = translate(copies['finished'],
+                                       record['time'] - time.monotonic())
+    later('pending', record)
+
+def later(key, item):
+    '''
+    add item to WAL[key] for the next `commit`, due within COMMIT seconds
+
+    caller must hold LOCK.
+    '''
+    if not WAL['pending'] and not WAL['clicks'] and not WAL['archive']:
+        schedule(time.monotonic() + COMMIT, wake)
+    WAL[key].append(item)
+
+def wake():
+    '''
+    have the writer thread `commit`, starting it if need be
+
+    called by the scheduler, whose thread must never wait for the disk:
+    every talksession's turns would end late while it did.
+    '''
+    if not WRITER or WRITER[1] != os.getpid():
+        WRITER[:] = [threading.Thread(target=writer, name='writer'),
+                     os.getpid()]
+        WRITER[0].daemon = True  # leave no zombies on exit
+        WRITER[0].start()
+    WRITE.set()
+
+def writer():
+    '''
+    `commit` whenever woken, forever
+    '''
+    while True:
+        WRITE.wait()
+        WRITE.clear()  # so a wake during the commit means another one
+        try:
+            commit()
+        except Exception:  # pylint: disable=broad-except
+            logging.error('writer: commit failed', exc_info=True)
+
+def commit():
+    '''
+    write and sync all changes since the last commit, in one go
+
+    runs in the writer thread, so neither requests nor timers ever wait
+    for the disk. every CHECKPOINTS records, CHECKPOINT is brought up to
+    date and a new generation of JOURNAL started, so `recover` never has
+    much to replay. finished groups are archived, after the journal says
+    they finished, and the oldest then evicted from memory. commits are
+    one at a time, since `stop` can make one too.
+    '''
+    with COMMITTING:
+        with LOCK:
+            records, WAL['pending'] = WAL['pending'], []
+            clicked, WAL['clicks'] = WAL['clicks'], []
+            finished, WAL['archive'] = WAL['archive'], []
+            WAL['records'] += len(records)
+            checkpoint = WAL['records'] >= CHECKPOINTS and SNAPSHOT
+        os.makedirs(os.path.dirname(JOURNAL), exist_ok=True)
+        journal = '%s.%d.jsonl' % (JOURNAL, WAL['generation'])
+        with open(journal, 'a') as outfile:
+            outfile.write(''.join(json.dumps(record) + '\n'
+                                  for record in records))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        try:  # only statistics, which mustn't cost the journal anything
+            save_clicks(clicked)
+        except OSError:
+            logging.error('commit: clicks not saved', exc_info=True)
+        for group, groupdata in finished:
+            archive(group, groupdata)
+        if finished:
+            evict(DATA)
+        if checkpoint:
+            # the snapshot includes every record written so far, and nothing
+            # that's still pending, so the next generation starts right here
+            offset = time.time() - time.monotonic()
+            state = {'generation': WAL['generation'] + 1,
+                     'groups': {group: translate(groupdata, offset)
+                                for group, groupdata in
+                                checkpoint['groups'].items()}}
+            with open(CHECKPOINT + '.tmp', 'w') as outfile:
+                json.dump(state, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(CHECKPOINT + '.tmp', CHECKPOINT)
+            WAL['generation'], WAL['records'] = state['generation'], 0
+            for generation in journals():
+                if generation < WAL['generation']:
+                    os.remove('%s.%d.jsonl' % (JOURNAL, generation))
+
+def save_clicks(clicked):
+    '''
+    append lines to files of clicks, and rename any that are finished
+
+    these are only statistics, so they're not synced to disk.
+    '''
+    lines = OrderedDict()
+    for path, line in clicked:
+        lines.setdefault(path, []).append(line)
+    for path, pathlines in lines.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'a') as outfile:
+            outfile.write(''.join(line for line in pathlines if line))
+        if None in pathlines:
+            os.replace(path + '.part', path)
+
+def journals():
+    '''
+    generations of JOURNAL on disk, oldest first
+    '''
+    directory, prefix = os.path.split(JOURNAL)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name.split('.')[1]) for name in names
+                  if re.fullmatch(re.escape(prefix) + r'\.\d+\.jsonl', name))
+
+def recover():
+    '''
+    rebuild DATA['groups'] from CHECKPOINT and JOURNAL after a restart
+
+    then restart their clocks. talksessions go on as if the restart never
+    happened: clocks, including that of the current speaker's turn, kept
+    running all through it.
+    '''
+    try:
+        with open(CHECKPOINT) as infile:
+            state = json.load(infile)
+    except FileNotFoundError:
+        state = {'generation': 0, 'groups': {}}
+    groups = state['groups']
+    generations = [generation for generation in journals()
+                   if generation >= state['generation']]
+    for generation in generations:
+        with open('%s.%d.jsonl' % (JOURNAL, generation)) as infile:
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # cut short by a crash
+                    continue
+                if record.get('data') is not None:
+                    groups[record['group']] = record['data']
+                else:
+                    groups.pop(record['group'], None)
+                if record.get('finished') and not archived(record['group']):
+                    # crashed before `finish` got to archive it
+                    archive(record['group'], record['finished'])
+    WAL['generation'] = max(generations + [state['generation']])
+    offset = time.monotonic() - time.time()
+    for group, groupdata in groups.items():
+        groupdata = translate(groupdata, offset)
+        for username in groupdata['participants']:
+            groupdata['participants'][username] = defaultdict(
+                float, groupdata['participants'][username])
+        with grouplock(group):
+            DATA['groups'][group] = groupdata
+            restart(group)
+            publish(group, event=None)
+    if groups:
+        logging.info('recovered groups %s', list(groups))
+
+def restart(group, data=None):
+    '''
+    reschedule a recovered group's timers, and requeue its requests
+
+    caller must hold the group's lock.
+    '''
+    data = data or DATA
+    groupdata = data['groups'][group]
+    talksession = groupdata.get('talksession')
+    if talksession is None or 'clock' not in talksession:
+        return  # nobody joined yet, so no clock is running
+    for username, userdata in groupdata['participants'].items():
+        if userdata.get('request'):
+            enqueue(group, username, data)
+    if talksession['speaker']:
+        schedule(talksession['since'] + float(groupdata['turn']), turn_over,
+                 group, data, (talksession['start'], talksession['turns']))
+    schedule(talksession['ending'], finish, group, data)
+
+def archive(group, groupdata):
+    '''
+    append a finished group to ARCHIVE, and its place there to the index
+    '''
+    line = (json.dumps(groupdata, separators=(',', ':')) + '\n').encode()
+    with ARCHIVELOCK:
+        index = archive_index()
+        os.makedirs(os.path.dirname(ARCHIVE), exist_ok=True)
+        with open(ARCHIVE, 'ab') as outfile:
+            offset = outfile.seek(0, os.SEEK_END)
+            outfile.write(line)
+        # written only after the group itself, so it never points past it
+        with open(ARCHIVE + '.index', 'a') as outfile:
+            outfile.write(json.dumps([group, offset, len(line)]) + '\n')
+        index[group] = (offset, len(line))
+
+def archived(group):
+    '''
+    read a finished group back from ARCHIVE, or None if it isn't there
+
+    only the group's own line is read, found by the index.
+    '''
+    with ARCHIVELOCK:
+        place = archive_index().get(group)
+    if place is None:
+        return None
+    with open(ARCHIVE, 'rb') as infile:
+        infile.seek(place[0])
+        return json.loads(infile.read(place[1]).decode('utf8'))
+
+def archive_index():
+    '''
+    index of ARCHIVE, loaded from disk the first time it's needed
+
+    the last entry for a group wins: a group of the same name may have
+    finished more than once. caller must hold ARCHIVELOCK.
+    '''
+    global ARCHIVEINDEX  # pylint: disable=global-statement
+    if ARCHIVEINDEX is None:
+        ARCHIVEINDEX = {}
+        try:
+            with open(ARCHIVE + '.index') as infile:
+                for line in infile:
+                    try:
+                        group, offset, length = json.loads(line)
+                    except ValueError:  # cut short by a crash
+                        continue
+                    ARCHIVEINDEX[group] = (offset, length)
+        except FileNotFoundError:
+            pass
+    return ARCHIVEINDEX
+
+def evict(data):
+    '''
+    drop the least recently finished groups beyond MAXFINISHED from memory
+
+    they're already in ARCHIVE, and are read back from there if needed.
+    '''
+    while len(data['finished']) > MAXFINISHED:
+        with LOCK:
+            group = next(iter(data['finished']))
+        with grouplock(group):
+            with LOCK:
+                data['finished'].pop(group, None)
+            REPORTS.pop(group, None)
+            publish(group, data, event='evict')
+            with LOCK:  # unless a group of the same name started meanwhile
+                if group not in data['groups']:
+                    GROUPLOCKS.pop(group, None)
 
 def update_httpsession(postdict):
     '''
@@ -719,10 +2541,9 @@ def update_httpsession(postdict):
     this is for keeping state between client and server, this is *not*
     the same as discussion (talk) sessions!
 
-    another thread should go through and remove expired httpsessions
+    caller must hold SESSIONLOCK.
     '''
     # FIXME: this session mechanism can only be somewhat secure with https
-    # FIXME: a thread needs to remove old httpsessions to save memory
     timestamp = postdict['timestamp']
     cookie = None
     if 'httpsession_key' in postdict and postdict['httpsession_key']:
@@ -740,19 +2561,21 @@ def update_httpsession(postdict):
                 if newgroup:
                     HTTPSESSIONS[session_key]['added_group'] = newgroup
                 HTTPSESSIONS[session_key]['updated'] = timestamp
+                HTTPSESSIONS.move_to_end(session_key)
             else:
                 HTTPSESSIONS[session_key] = {
                     'timestamp': timestamp,
                     'updated': timestamp,
                     'added_group': None,
                     'username': username}
+                expire_httpsessions(timestamp)
             cookie = SimpleCookie()
             cookie['sessionid'] = session_key
             cookie['sessionid']['path'] = '/'
-            logging.debug('cookie: %s', cookie)
+            debug('sessions', 'cookie: %s', cookie)
             cookie['username'] = username
             cookie['username']['path'] = '/'
-            logging.debug('cookie: %s', cookie)
+            debug('sessions', 'cookie: %s', cookie)
         else:
             debug('sessions',
                   'no username yet associated with session %s', session_key)
@@ -760,26 +2583,99 @@ def update_httpsession(postdict):
         logging.warning('no httpsession_key in POST')
     return cookie
 
+def expire_httpsessions(now):
+    '''
+    drop sessions not updated in SESSIONTTL seconds, then any beyond
+    MAXSESSIONS, least recently updated first
+
+    HTTPSESSIONS is kept in order of `updated`, so only the sessions being
+    dropped, and one more, are looked at: on average, a constant cost
+    per session created. caller must hold SESSIONLOCK.
+
+    >>> HTTPSESSIONS.update({'old': {'updated': 0}, 'new': {'updated': 1e9}})
+    >>> counts = dict(SESSIONCOUNTS)
+    >>> expire_httpsessions(1e9)
+    >>> list(HTTPSESSIONS), SESSIONCOUNTS['expired'] - counts['expired']
+    (['new'], 1)
+    >>> HTTPSESSIONS.clear()
+    '''
+    while HTTPSESSIONS:
+        session_key, session = next(iter(HTTPSESSIONS.items()))
+        if session['updated'] < now - SESSIONTTL:
+            SESSIONCOUNTS['expired'] += 1
+        elif len(HTTPSESSIONS) > MAXSESSIONS:
+            SESSIONCOUNTS['evicted'] += 1
+        else:
+            break
+        debug('sessions', 'dropping session %s', session_key)
+        del HTTPSESSIONS[session_key]
+
 def render(pagename, standalone=True):
     '''
-    Return content with Content-type header
+    Return static file, as cached by `static`, with its Content-type
     '''
     debug('render', 'render(%s, %s) called', pagename, standalone)
     if pagename.endswith('.html'):
         debug('render', 'rendering static HTML content')
-        return (read(pagename), 'text/html')
+        return static(pagename)
     elif not pagename.endswith(('.png', '.ico', '.jpg', '.jpeg')):
-        # assume plain text
         logging.warning('app is serving %s instead of nginx', pagename)
-        return (read(pagename), 'text/plain')
+        return static(pagename)
     elif standalone:
         logging.warning('app is serving %s instead of nginx', pagename)
-        return (read(pagename),
-                MIMETYPES.get(os.path.splitext(pagename)[1], 'text/plain'))
+        return static(pagename)
     else:
         logging.error('not standalone, and no match for filetype')
         raise OSError('File not found: %s' % pagename)
 
+def static(filename):
+    '''
+    a file's bytes, gzipped bytes if worth having, mimetype and ETag
+
+    the file is only read again when its size or modification time
+    changes, so serving it costs one `stat`. nothing outside APPDIR is
+    served, however the path got there.
+
+    >>> asset = static(os.path.join(APPDIR, 'client.js'))
+    >>> asset['mimetype'], len(asset['gzip']) < len(asset['body'])
+    ('application/javascript', True)
+    >>> static(os.path.join(APPDIR, 'client.js')) is asset
+    True
+    >>> static(os.path.join(APPDIR, 'images', 'myturn-logo.png'))['gzip']
+    >>> static(os.path.join(APPDIR, os.pardir, 'pyturn.uwsgi'))
+    ... # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    FileNotFoundError: File not found: .../pyturn.uwsgi
+    '''
+    filename = os.path.realpath(filename)
+    if os.path.commonpath([filename, APPROOT]) != APPROOT:
+        raise FileNotFoundError('File not found: %s' % filename)
+    status = os.stat(filename)
+    key = (status.st_mtime_ns, status.st_size)
+    cached = STATIC.get(filename)
+    if cached is not None and cached['key'] == key:
+        return cached
+    debug('read', 'static: reading %s', filename)
+    with open(filename, 'rb') as infile:
+        body = infile.read()
+    mimetype = MIMETYPES.get(os.path.splitext(filename)[1].lstrip('.'),
+                             'text/plain')
+    gzipped = None
+    if mimetype.startswith(COMPRESSIBLE):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gzipped = compressor.compress(body) + compressor.flush()
+        if len(gzipped) >= len(body):
+            gzipped = None
+    cached = STATIC[filename] = {
+        'key': key,
+        'body': body,
+        'gzip': gzipped,
+        'mimetype': mimetype,
+        'etag': '"%x-%x"' % key,
+    }
+    return cached
+
 def read(filename):
     '''
     Return contents of a file
@@ -790,6 +2686,44 @@ def read(filename):
         debug('read', 'data: %s', data[:128])
         return data
 
+def start():
+    '''
+    recover the groups this process keeps, and start its events server
+
+    only for a process that serves: under uwsgi, `serve`, `state`, or ASGI,
+    never on import, so doctests and `myturn.py statistics` leave the
+    meetings, and JOURNAL, to the server. only the first call counts.
+    '''
+    if STARTED:  # cheap enough for `asgi` to call on every request
+        return
+    with LOCK:
+        if STARTED:
+            return
+        STARTED.append(True)
+    if isinstance(BACKEND, LocalState):  # otherwise the state server's job
+        recover()
+        if EVENTSOCKET:
+            eventserver(EVENTSOCKET)
+
+def stop():
+    '''
+    run no more timers, and write what hasn't been, before a clean exit
+
+    the scheduler thread is left waiting on a timer that never returns, so
+    nothing it does can be cut short halfway, and it can't wake the writer
+    again. for a process done with MyTurn but not yet exiting, such as
+    benchmark.py, which mustn't leave a journal behind to be recovered.
+    '''
+    parked, never = threading.Event(), threading.Event()
+    def park():
+        parked.set()
+        never.wait()
+    schedule(0, park)  # before anything else, however overdue
+    parked.wait()
+    with TIMER:
+        del TIMERS[:]
+    commit()
+
 def formatseconds(seconds):
     '''
     return rounded-up seconds count as HH:MM:SS
@@ -801,5 +2735,30 @@ def formatseconds(seconds):
     '''
     return '{:0>8}'.format(str(datetime.timedelta(seconds=round(seconds))))
 
+compile_templates()
+
+if METRICS:  # only now that MeteredLock is defined
+    LOCK = MeteredLock('registry')
+
+BACKEND = SharedState(STATE) if STATE else LocalState()
+STARTED = []  # not empty once `start` has run
+
+if uwsgi.opt:  # loaded by uwsgi, as its app
+    start()
+
 if __name__ == '__main__':
-    print(server(os.environ, lambda *args: None))
+    if sys.argv[1:2] in (['serve'], ['state']):  # no signals under uwsgi
+        # not in the handler itself, which could interrupt a lock holder
+        signal.signal(signal.SIGUSR2, lambda *args: threading.Thread(
+            target=profile, args=(10,)).start())
+    if sys.argv[1:2] == ['serve']:  # e.g. `myturn.py serve localhost:5678`
+        start()
+        asyncio.run(serve((sys.argv[2:] or ['localhost:5678'])[0]))
+    elif sys.argv[1:2] == ['statistics']:  # `myturn.py statistics [dir]`
+        print(json.dumps(summarize(clicks(*sys.argv[2:3])), indent=4))
+    elif sys.argv[1:2] == ['state']:  # `myturn.py state /tmp/state.sock`
+        BACKEND = LocalState()  # events happen here, not in the clients
+        start()
+        stateserver((sys.argv[2:] or [STATE])[0])
+    else:
+        print(server(os.environ, lambda *args: None))